@@ -0,0 +1,188 @@
+import collections
+import threading
+import time
+
+from metrics import registry, Counter, Gauge, Histogram
+
+ADMISSION_QUEUE_DEPTH = registry.register(Gauge(
+    'tabtogether_admission_queue_depth', 'Model calls waiting for admission'))
+ADMISSION_ACTIVE = registry.register(Gauge(
+    'tabtogether_admission_active', 'Model calls currently admitted'))
+ADMISSION_WAIT_SECONDS = registry.register(Histogram(
+    'tabtogether_admission_wait_seconds', 'Time model calls spent waiting for admission', ['outcome']))
+ADMISSION_REJECTED = registry.register(Counter(
+    'tabtogether_admission_rejected_total', 'Model calls turned away by admission control, by reason', ['reason']))
+
+
+class AdmissionRejected(Exception):
+    status_code = 429
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('client', 'tokens', 'admitted')
+
+    def __init__(self, client, tokens):
+        self.client = client
+        self.tokens = tokens
+        self.admitted = False
+
+
+class AdmissionController:
+    # Gate in front of the model provider. At most `max_concurrency` calls
+    # run at once and, when `tokens_per_minute` is set, their estimated
+    # tokens are drawn from a bucket that refills at that rate. Calls that
+    # cannot start wait in per-client FIFO queues that are served round-robin,
+    # so one client uploading a hundred receipts cannot starve the others.
+    # When the queue (or the client's share of it) is full, or a call has
+    # waited `max_wait` seconds, AdmissionRejected is raised with a
+    # Retry-After estimate.
+
+    def __init__(self, max_concurrency=16, max_queue=64, max_queue_per_client=16, max_wait=30.0,
+                 tokens_per_minute=0, tokens_per_call=1500):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait = max_wait
+        self.tokens_per_minute = tokens_per_minute
+        self.tokens_per_call = tokens_per_call
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._active = 0
+        self._queued = 0
+        self._queues = collections.OrderedDict()  # client -> deque of waiters, in round-robin order
+        self._hold_seconds = 2.0  # moving average of how long an admitted call runs
+        self._stats = {'admitted': 0, 'rejected': 0}
+        self._cond = threading.Condition()
+
+    def check(self, client=''):
+        # Fast pre-flight for callers that cannot report a rejection later,
+        # e.g. once a streaming response has started
+        with self._cond:
+            self._check_capacity(client)
+
+    def acquire(self, client='', tokens=None):
+        # Blocks until the call may start; every successful acquire must be
+        # paired with release(), passing how long the call held its slot
+        started = time.monotonic()
+        tokens = min(tokens or self.tokens_per_call, self.tokens_per_minute) if self.tokens_per_minute else 0
+        with self._cond:
+            if not self._queues and self._active < self.max_concurrency and self._take_tokens(tokens):
+                self._active += 1
+                self._admitted(started)
+                return
+            self._check_capacity(client)
+            waiter = _Waiter(client, tokens)
+            self._queues.setdefault(client, collections.deque()).append(waiter)
+            self._queued += 1
+            ADMISSION_QUEUE_DEPTH.set(self._queued)
+            deadline = started + self.max_wait
+            while True:
+                wake_in = self._dispatch()
+                if waiter.admitted:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(waiter)
+                    ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started, outcome='timeout')
+                    self._reject('timeout', f'Waited {self.max_wait:g}s for model capacity')
+                self._cond.wait(min(remaining, wake_in) if wake_in is not None else remaining)
+            self._admitted(started)
+
+    def release(self, held):
+        with self._cond:
+            self._active -= 1
+            ADMISSION_ACTIVE.set(self._active)
+            self._hold_seconds += 0.2 * (held - self._hold_seconds)
+            self._dispatch()
+
+    def stats(self):
+        with self._cond:
+            self._refill()
+            return dict(
+                self._stats,
+                active=self._active,
+                queued=self._queued,
+                clients_waiting=len(self._queues),
+                tokens_available=round(self._tokens) if self.tokens_per_minute else None,
+                max_concurrency=self.max_concurrency,
+                max_queue=self.max_queue,
+                tokens_per_minute=self.tokens_per_minute,
+            )
+
+    def _admitted(self, started):
+        self._stats['admitted'] += 1
+        ADMISSION_ACTIVE.set(self._active)
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started, outcome='admitted')
+
+    def _check_capacity(self, client):
+        if self._queued >= self.max_queue:
+            self._reject('queue_full', 'Too many receipts are waiting for the model')
+        queue = self._queues.get(client)
+        if queue is not None and len(queue) >= self.max_queue_per_client:
+            self._reject('client_queue_full', 'Too many of your receipts are waiting for the model')
+
+    def _reject(self, reason, message):
+        self._stats['rejected'] += 1
+        ADMISSION_REJECTED.inc(reason=reason)
+        raise AdmissionRejected(message, self._retry_after())
+
+    def _retry_after(self):
+        # Roughly when the work already queued will have drained
+        retry_after = (self._queued + 1) * self._hold_seconds / self.max_concurrency
+        if self.tokens_per_minute:
+            queued_tokens = sum(w.tokens for queue in self._queues.values() for w in queue)
+            retry_after = max(retry_after, (queued_tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return max(1.0, retry_after)
+
+    def _dispatch(self):
+        # Admits waiters round-robin across clients while there is capacity.
+        # Returns seconds until the token bucket can admit the next waiter,
+        # or None when it is not what is holding them back.
+        admitted = False
+        wake_in = None
+        while self._queues and self._active < self.max_concurrency:
+            client, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if not self._take_tokens(waiter.tokens):
+                wake_in = (waiter.tokens - self._tokens) * 60 / self.tokens_per_minute
+                break
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self._queued -= 1
+            waiter.admitted = True
+            self._active += 1
+            admitted = True
+        if admitted:
+            ADMISSION_QUEUE_DEPTH.set(self._queued)
+            self._cond.notify_all()
+        return wake_in
+
+    def _remove(self, waiter):
+        queue = self._queues[waiter.client]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.client]
+        self._queued -= 1
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._refilled) * self.tokens_per_minute / 60)
+        self._refilled = now
+
+    def _take_tokens(self, tokens):
+        if not self.tokens_per_minute:
+            return True
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
@@ -1,35 +1,381 @@
-from flask import Flask, request, jsonify
-from datetime import datetime
-import openai
+from flask import Blueprint, Flask, Response, g, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import math
 import os
 import json
+import threading
+import time
 
-app = Flask(__name__)
+from admission import AdmissionController, AdmissionRejected
+from db import Database
+import decoding
+from jobs import JobQueue, QueueFull
+import metrics
+import sync
+from metrics import MODEL_PAYLOAD_BYTES, PARSE_FAILURES, PARSES_IN_FLIGHT, REQUEST_SECONDS, REQUESTS_IN_FLIGHT
+from history import MAX_SYNC_BATCH, BillHistory
+from item_stream import ItemStreamDecoder
+from local_parse import LocalParser
+from parse_cache import ParseCache, cache_key
+from parsers import PROMPT_VERSION, backend_from_env
+from preprocess import Preprocessor
+from receipt_store import ReceiptStore, new_receipt
+from storage import UploadStore
+from timing import Stages
+from singleflight import SingleFlight
+from split_engine import apply_split_delta, build_split_state, numpy_module, split_bill as split_itemized_bill, split_bills
+
+# Routes live on a blueprint so create_app() can build the application
+api = Blueprint('api', __name__, cli_group=None)
 UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# For demo: store last parsed items in memory (replace with DB for production)
-last_parsed_items = []
-
-def parse_receipt_with_gpt(image_path):
-    with open(image_path, "rb") as image_file:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that extracts items and prices from receipts."},
-                {"role": "user", "content": "Please extract all items and prices from this receipt and return as JSON array of {item, price}."}
-            ],
-            files=[{"name": "receipt.jpg", "data": image_file.read()}],
-        )
-    content = response.choices[0].message.content
-    items = json.loads(content)
+
+uploads = UploadStore(
+    UPLOAD_FOLDER,
+    ttl=int(os.getenv('UPLOAD_TTL', 30 * 24 * 3600)),
+    max_bytes=int(os.getenv('UPLOAD_MAX_BYTES', 5 * 1024 ** 3)),
+    sweep_interval=int(os.getenv('UPLOAD_SWEEP_INTERVAL', 600)),
+)
+
+# Selected with PARSER_BACKEND ('openai' or 'fake'), see parsers.py
+parser_backend = backend_from_env()
+
+preprocessor = Preprocessor(
+    enabled=os.getenv('PREPROCESS_ENABLED', '1') != '0',
+    max_dim=int(os.getenv('PREPROCESS_MAX_DIM', 1600)),
+    quality=int(os.getenv('PREPROCESS_QUALITY', 80)),
+    grayscale=os.getenv('PREPROCESS_GRAYSCALE', '1') != '0',
+    crop=os.getenv('PREPROCESS_CROP', '1') != '0',
+    workers=int(os.getenv('PREPROCESS_WORKERS', 2)),
+    executor=os.getenv('PREPROCESS_EXECUTOR', 'thread'),
+)
+
+# Cheap OCR + regex tier tried before the model; needs pytesseract and the tesseract binary
+local_parser = LocalParser(
+    enabled=os.getenv('LOCAL_PARSE_ENABLED', '1') != '0',
+    threshold=float(os.getenv('LOCAL_PARSE_THRESHOLD', 0.9)),
+)
+
+parse_cache = ParseCache(
+    max_entries=int(os.getenv('PARSE_CACHE_ENTRIES', 256)),
+    disk_dir=os.getenv('PARSE_CACHE_DIR') or None,
+    ttl=int(os.getenv('PARSE_CACHE_TTL', 7 * 24 * 3600)),
+    max_bytes=int(os.getenv('PARSE_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+)
+
+# Identical images being parsed at the same time share one model call. Set
+# PARSE_LEASE_DIR (together with PARSE_CACHE_DIR) to coalesce across worker processes too.
+parse_flights = SingleFlight(
+    lease_dir=os.getenv('PARSE_LEASE_DIR') or None,
+    lease_timeout=float(os.getenv('PARSE_LEASE_TIMEOUT', 120)),
+)
+
+# Caps model calls across every upload path: concurrency, an optional
+# tokens-per-minute budget (MODEL_TOKENS_PER_MINUTE, 0 = unlimited) and a
+# bounded wait queue shared fairly between clients; see admission.py.
+# ADMISSION_CONCURRENCY and MODEL_TOKENS_PER_MINUTE are limits for the whole
+# server. Each worker process enforces an equal share of them, so the
+# provider never sees more than the configured totals; WEB_CONCURRENCY is
+# the number of worker processes (gunicorn.conf.py exports it to workers).
+# The share is also capped at the backend's connection pool (MODEL_POOL_SIZE),
+# since admitting more calls than there are connections only moves the wait
+# into the pool.
+ADMISSION_PROCESSES = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+MODEL_TOKENS_PER_MINUTE = int(os.getenv('MODEL_TOKENS_PER_MINUTE', 0))
+ADMISSION_CONCURRENCY = max(1, int(os.getenv('ADMISSION_CONCURRENCY', 16)) // ADMISSION_PROCESSES)
+if parser_backend.max_concurrency is not None:
+    ADMISSION_CONCURRENCY = min(ADMISSION_CONCURRENCY, parser_backend.max_concurrency)
+admission = AdmissionController(
+    max_concurrency=ADMISSION_CONCURRENCY,
+    max_queue=int(os.getenv('ADMISSION_QUEUE', 64)),
+    max_queue_per_client=int(os.getenv('ADMISSION_QUEUE_PER_CLIENT', 16)),
+    max_wait=float(os.getenv('ADMISSION_MAX_WAIT', 30)),
+    tokens_per_minute=max(1, MODEL_TOKENS_PER_MINUTE // ADMISSION_PROCESSES) if MODEL_TOKENS_PER_MINUTE else 0,
+    tokens_per_call=int(os.getenv('MODEL_TOKENS_PER_PARSE', 1500)),
+)
+
+# Model calls repeated when a response cannot be decoded even after local repair
+DECODE_RETRIES = int(os.getenv('DECODE_RETRIES', 1))
+
+# Shared across /upload/batch requests so the total number of concurrent batch parses stays capped
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 50))
+batch_pool = ThreadPoolExecutor(max_workers=int(os.getenv('BATCH_CONCURRENCY', 8)), thread_name_prefix='batch-parse')
+
+# Set when the worker starts draining for shutdown
+shutting_down = threading.Event()
+
+db = Database(os.getenv('DATABASE_PATH', 'tabtogether.db'))
+receipts = ReceiptStore(db, cache_size=int(os.getenv('RECEIPT_CACHE_SIZE', 128)))
+history = BillHistory(db)
+
+# Parse concurrency for ?async=1 uploads, tuned independently of the HTTP
+# server's workers. Job status is in the database, so any worker can answer a poll.
+parse_jobs = JobQueue(
+    db,
+    workers=int(os.getenv('PARSE_WORKERS', 4)),
+    max_pending=int(os.getenv('PARSE_MAX_PENDING', 64)),
+)
+
+def read_image(image_path, stages):
+    with stages.time('read'), open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    with stages.time('preprocess'):
+        image_bytes = preprocessor.run(image_bytes)
+    MODEL_PAYLOAD_BYTES.observe(len(image_bytes))
+    return image_bytes
+
+def parse_cache_key(image_path):
+    version = f'{PROMPT_VERSION}:{preprocessor.signature}:{local_parser.signature}'
+    return cache_key(uploads.content_hash(image_path), parser_backend.model, version)
+
+def parse_locally(image_bytes, stages):
+    if not local_parser.enabled:
+        return None
+    with stages.time('local_parse'):
+        items, _ = local_parser.parse(image_bytes)
+    if items is not None:
+        local_parser.record('local')
+    return items
+
+def parse_receipt(image_path, stages=None, client=''):
+    stages = stages or Stages()
+    image_bytes = read_image(image_path, stages)
+    items = parse_locally(image_bytes, stages)
+    if items is not None:
+        return items
+    local_parser.record('model')
+    with stages.time('admission'):
+        admission.acquire(client)
+    admitted = time.monotonic()
+    PARSES_IN_FLIGHT.inc()
+    try:
+        for attempt in range(DECODE_RETRIES + 1):
+            with stages.time('model'):
+                content = parser_backend.complete(image_bytes)
+            try:
+                with stages.time('decode'):
+                    items, repairs = decoding.decode_items(content)
+            except decoding.DecodeError:
+                decoding.record_failure(retrying=attempt < DECODE_RETRIES)
+                if attempt == DECODE_RETRIES:
+                    raise
+            else:
+                decoding.record(repairs)
+                break
+    except Exception as e:
+        PARSE_FAILURES.inc(exception=type(e).__name__)
+        raise
+    finally:
+        PARSES_IN_FLIGHT.dec()
+        admission.release(time.monotonic() - admitted)
+    return items
+
+def parse_receipt_cached(image_path, stages=None, client=''):
+    stages = stages or Stages()
+    with stages.time('cache'):
+        key = parse_cache_key(image_path)
+        items = parse_cache.get(key)
+    if items is not None:
+        return items
+
+    def parse():
+        started = time.monotonic()
+        items = parse_receipt(image_path, stages, client)
+        parse_cache.put(key, items, elapsed=time.monotonic() - started)
+        return items
+
+    # Only time spent waiting on someone else's parse counts as coalescing;
+    # a leader's own parse is already broken down into its stages
+    started = time.perf_counter()
+    led, items = parse_flights.do(key, parse, recheck=lambda: parse_cache.get(key))
+    if not led:
+        stages.record('coalesce', time.perf_counter() - started)
+    return items
+
+def parse_and_store(image_path, stages=None, client=''):
+    stages = stages or Stages()
+    items = parse_receipt_cached(image_path, stages, client)
+    with stages.time('store'):
+        receipt = receipts.save(new_receipt(items, image_path))
+    return {'receipt_id': receipt['id'], 'items': items}
+
+def error_response(e):
+    # Exceptions may carry an HTTP status (e.g. 503 while the model circuit is
+    # open) and a Retry-After hint
+    response = jsonify({'error': str(e)})
+    response.status_code = getattr(e, 'status_code', 500)
+    if getattr(e, 'retry_after', None) is not None:
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+    return response
+
+def client_id():
+    # Who admission control queues a request under, for fairness
+    return request.headers.get('X-User-Id') or request.remote_addr or ''
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+def stream_items(image_path, key, stages, client, started):
+    # Yields `item` events for a parse this request leads, trying the local
+    # parser before streaming from the model, and returns the items
+    image_bytes = read_image(image_path, stages)
+    local_started = time.monotonic()
+    items = parse_locally(image_bytes, stages)
+    if items is not None:
+        for item in items:
+            yield sse_event('item', item)
+        parse_cache.put(key, items, elapsed=time.monotonic() - local_started)
+        return items
+    local_parser.record('model')
+    items = []
+    # Items already sent cannot be taken back, so each one is
+    # repaired, or dropped, on its own as it arrives
+    repairs = []
+    decoder = ItemStreamDecoder(loads=lambda text: decoding.load_item(text, repairs))
+    with stages.time('admission'):
+        admission.acquire(client)
+    model_started = time.monotonic()
+    PARSES_IN_FLIGHT.inc()
+    try:
+        for chunk in parser_backend.stream(image_bytes):
+            for item in decoder.feed(chunk):
+                if not items:
+                    stages.record('first_item', time.perf_counter() - started)
+                items.append(item)
+                yield sse_event('item', item)
+        if not decoder.done:
+            decoding.record_failure(retrying=False)
+            raise decoding.DecodeError('Model response was not a complete JSON array')
+        if not items and 'dropped' in repairs:
+            decoding.record_failure(retrying=False)
+            raise decoding.DecodeError('None of the items in the model response were usable')
+        decoding.record(repairs)
+    except Exception as e:
+        PARSE_FAILURES.inc(exception=type(e).__name__)
+        raise
+    finally:
+        PARSES_IN_FLIGHT.dec()
+        admission.release(time.monotonic() - model_started)
+    stages.record('model', time.monotonic() - model_started)
+    parse_cache.put(key, items, elapsed=time.monotonic() - model_started)
     return items
 
-@app.route('/upload', methods=['POST'])
+def stream_parse_and_store(image_path, stages=None, client=''):
+    # Server-Sent Events version of parse_and_store: each item is sent as an
+    # `item` event as soon as the model has produced it, then a `done` event
+    # carries the receipt id. Failures arrive as an `error` event because the
+    # 200 status has already been sent by then.
+    stages = stages or Stages()
+    started = time.perf_counter()
+    try:
+        with stages.time('cache'):
+            key = parse_cache_key(image_path)
+            items = parse_cache.get(key)
+        if items is None:
+            # Identical uploads made while this one is parsing, streamed or
+            # not, wait for its items rather than calling the model again
+            flight, led = parse_flights.begin(key)
+            if not led:
+                waited_from = time.perf_counter()
+                items = parse_flights.result(flight)
+                stages.record('coalesce', time.perf_counter() - waited_from)
+                for item in items:
+                    yield sse_event('item', item)
+            else:
+                try:
+                    items = yield from stream_items(image_path, key, stages, client, started)
+                except BaseException as e:
+                    if not isinstance(e, Exception):
+                        # The client went away; followers get an error they can retry on
+                        e = ConnectionAbortedError('The request parsing this receipt was cancelled')
+                    parse_flights.finish(key, flight, error=e)
+                    raise
+                parse_flights.finish(key, flight, result=items)
+        else:
+            for item in items:
+                yield sse_event('item', item)
+        with stages.time('store'):
+            receipt = receipts.save(new_receipt(items, image_path))
+        yield sse_event('done', {'receipt_id': receipt['id'], 'count': len(items), 'total': receipt['totalAmount']})
+    except Exception as e:
+        yield sse_event('error', {'error': str(e)})
+
+def save_upload(file, stages=None):
+    stages = stages or Stages()
+    # Started here rather than at import to keep startup cheap; until the
+    # first upload there is nothing new to sweep
+    uploads.start_sweeper()
+    with stages.time('save'):
+        stored = uploads.save(file)
+    return stored.path
+
+@api.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(endpoint=request.endpoint)
+
+@api.after_app_request
+def record_request_metrics(response):
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint, status=response.status_code)
+    return response
+
+@api.teardown_app_request
+def finish_request_metrics(exc):
+    REQUESTS_IN_FLIGHT.dec(endpoint=request.endpoint)
+
+def collect_model_client_metrics():
+    stats = parser_backend.stats()
+    if not stats:
+        return {}
+    pool, breaker = stats['pool'], stats['breaker']
+    return {
+        'tabtogether_model_pool_connections': ('gauge', 'Model client connections, by state', {
+            (('state', 'in_use'),): pool['in_use'],
+            (('state', 'idle'),): pool['idle'],
+        }),
+        'tabtogether_model_pool_events_total': ('counter', 'Model client connection pool events', {
+            (('event', event),): pool[event] for event in ('created', 'reused', 'discarded')
+        }),
+        'tabtogether_model_retries_total': ('counter', 'Model calls retried after a retryable error', {
+            (): stats['retries'],
+        }),
+        'tabtogether_model_circuit_open': ('gauge', 'Model circuit breaker state (1 = open or half-open)', {
+            (): 0 if breaker['state'] == 'closed' else 1,
+        }),
+        'tabtogether_model_circuit_opens_total': ('counter', 'Times the model circuit breaker has opened', {
+            (): breaker['opens'],
+        }),
+    }
+
+def collect_app_metrics():
+    stats = parse_cache.stats()
+    upload_stats = uploads.stats()
+    return {
+        'tabtogether_parse_cache_events_total': ('counter', 'Parse cache lookups and writes, by outcome', {
+            (('event', event),): stats[event] for event in ('memory_hits', 'disk_hits', 'misses', 'stores', 'evictions')
+        }),
+        'tabtogether_parse_cache_saved_model_seconds_total': ('counter', 'Estimated model time saved by parse cache hits', {
+            (): stats['saved_model_seconds'],
+        }),
+        'tabtogether_parse_jobs_pending': ('gauge', 'Async parse jobs queued or running', {
+            (): parse_jobs.pending,
+        }),
+        'tabtogether_uploads_total': ('counter', 'Saved uploads, by whether the content was already stored', {
+            (('outcome', 'stored'),): upload_stats['stored'],
+            (('outcome', 'deduplicated'),): upload_stats['deduplicated'],
+        }),
+        'tabtogether_uploads_evicted_total': ('counter', 'Upload files removed by the retention sweeper', {
+            (): upload_stats['evicted'],
+        }),
+        'tabtogether_upload_storage_bytes': ('gauge', 'Bytes of stored uploads as of the last sweep', {
+            (): upload_stats['bytes'],
+        }),
+    }
+
+metrics.registry.add_collector(collect_app_metrics)
+metrics.registry.add_collector(collect_model_client_metrics)
+
+@api.route('/upload', methods=['POST'])
 def upload():
-    global last_parsed_items
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
 
@@ -37,23 +383,90 @@ def upload():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    filename = datetime.now().strftime('%Y%m%d%H%M%S') + '_' + file.filename
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
+    stages = Stages()
+    client = client_id()
+
+    if request.args.get('stream') == '1':
+        # Once the stream has started the status can no longer become a 429,
+        # so an overloaded server turns the request away up front
+        try:
+            admission.check(client)
+        except AdmissionRejected as e:
+            return error_response(e)
+        filepath = save_upload(file, stages)
+        return Response(stream_parse_and_store(filepath, stages, client), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    filepath = save_upload(file, stages)
+
+    if request.args.get('async') == '1':
+        try:
+            job_id = parse_jobs.submit(parse_and_store, filepath, client=client)
+        except QueueFull as e:
+            return jsonify({'error': f'Parse queue is full: {e}'}), 503
+        return jsonify({'job_id': job_id, 'status': 'queued'}), 202
 
     try:
-        items = parse_receipt_with_gpt(filepath)
-        last_parsed_items = items  # save for splitting
-        return jsonify({'items': items})
+        response = jsonify(parse_and_store(filepath, stages, client))
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        response = error_response(e)
+    response.headers['Server-Timing'] = stages.server_timing()
+    return response
 
-@app.route('/split', methods=['POST'])
+@api.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    files = [f for f in request.files.getlist('files') if f.filename != '']
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'At most {BATCH_MAX_FILES} files per batch'}), 400
+
+    # The request body has to be read in order, so files are saved first and
+    # then all parses run together on the shared pool.
+    futures = {}
+    client = client_id()
+    for index, file in enumerate(files):
+        futures[batch_pool.submit(parse_and_store, save_upload(file), client=client)] = (index, file.filename)
+
+    def result_for(future):
+        index, filename = futures[future]
+        try:
+            return dict(future.result(), index=index, filename=filename)
+        except Exception as e:
+            return {'index': index, 'filename': filename, 'error': str(e)}
+
+    if request.args.get('stream') == '1':
+        # Newline-delimited JSON, one line per file in completion order
+        def generate():
+            for future in as_completed(futures):
+                yield json.dumps(result_for(future)) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    results = sorted((result_for(future) for future in as_completed(futures)), key=lambda r: r['index'])
+    return jsonify({'results': results})
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = parse_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    body = {'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'done':
+        body.update(job['result'])
+    elif job['status'] == 'error':
+        body['error'] = job['error']
+    return jsonify(body)
+
+@api.route('/split', methods=['POST'])
 def split_bill():
-    global last_parsed_items
     data = request.get_json()
-    if not data or 'people' not in data:
+    if not isinstance(data, dict) or 'people' not in data:
         return jsonify({'error': 'Missing "people" parameter'}), 400
+    if 'receipt_id' not in data:
+        return jsonify({'error': 'Missing "receipt_id" parameter'}), 400
+    if not isinstance(data['receipt_id'], str):
+        return jsonify({'error': '"receipt_id" must be a string'}), 400
 
     try:
         people = int(data['people'])
@@ -62,17 +475,240 @@ def split_bill():
     except:
         return jsonify({'error': '"people" must be a positive integer'}), 400
 
-    if not last_parsed_items:
-        return jsonify({'error': 'No receipt items found. Upload a receipt first.'}), 400
+    receipt = receipts.get(data['receipt_id'])
+    if receipt is None:
+        return jsonify({'error': 'Receipt not found. Upload a receipt first.'}), 404
 
-    total = sum(item.get('price', 0) for item in last_parsed_items)
+    total = sum(item['price'] * item['quantity'] for item in receipt['items'])
     per_person = round(total / people, 2)
 
     return jsonify({
+        'receipt_id': receipt['id'],
         'total': round(total, 2),
         'people': people,
         'per_person': per_person
     })
 
+@api.route('/split/itemized', methods=['POST'])
+def split_itemized():
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'Missing bill'}), 400
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid bill: expected a JSON object'}), 400
+
+    try:
+        if 'bills' in data:
+            return jsonify({'results': split_bills(data['bills'])})
+        if 'receipt_id' in data:
+            if not isinstance(data['receipt_id'], str):
+                return jsonify({'error': '"receipt_id" must be a string'}), 400
+            receipt = receipts.get(data['receipt_id'])
+            if receipt is None:
+                return jsonify({'error': 'Receipt not found. Upload a receipt first.'}), 404
+            # Assignments, participants and tip/tax in the request override the stored receipt
+            data = {**receipt, **{k: v for k, v in data.items() if k != 'receipt_id'}}
+        return jsonify(split_itemized_bill(data))
+    except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+        return jsonify({'error': f'Invalid bill: {e}'}), 400
+
+@api.route('/receipts/<receipt_id>', methods=['GET'])
+def get_receipt(receipt_id):
+    receipt = receipts.get(receipt_id)
+    if receipt is None:
+        return jsonify({'error': 'Receipt not found'}), 404
+    return jsonify(receipt)
+
+@api.route('/receipts/<receipt_id>/assignments', methods=['PATCH'])
+def update_assignments(receipt_id):
+    delta = request.get_json()
+    if not delta:
+        return jsonify({'error': 'Missing assignment delta'}), 400
+
+    def apply(receipt):
+        # Running totals are built once, on the first edit of a receipt
+        state = receipt.get('splitState') or build_split_state(receipt)
+        changed = apply_split_delta(receipt, state, delta)
+        receipt['splitState'] = state
+        return changed
+
+    try:
+        receipt, changed = receipts.update(receipt_id, apply)
+    except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+        return jsonify({'error': f'Invalid assignment delta: {e}'}), 400
+    if receipt is None:
+        return jsonify({'error': 'Receipt not found'}), 404
+
+    state = receipt['splitState']
+    return jsonify({
+        'receipt_id': receipt_id,
+        'changed': changed,
+        'unassignedTotal': (state['unassigned'] + state['taxShares']['_unassigned'] + state['tipShares']['_unassigned']) / 100,
+    })
+
+def current_user():
+    # There are no accounts yet; clients that sync set X-User-Id, local-only
+    # usage shares the empty user
+    return request.headers.get('X-User-Id', '')
+
+@api.route('/history', methods=['POST'])
+def save_bill():
+    data = request.get_json()
+    if not data or 'receipt' not in data:
+        return jsonify({'error': 'Missing "receipt" parameter'}), 400
+    try:
+        bill = history.save(data['receipt'], image_uri=data.get('imageUri', ''), user_id=current_user())
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid receipt: {e}'}), 400
+    return jsonify(bill), 201
+
+@api.route('/history', methods=['GET'])
+def list_bills():
+    args = request.args
+    try:
+        bills, next_cursor = history.search(
+            user_id=current_user(),
+            query=args.get('q'),
+            date_from=args.get('date_from'),
+            date_to=args.get('date_to'),
+            min_amount=args.get('min_amount'),
+            max_amount=args.get('max_amount'),
+            participant_count=args.get('participant_count'),
+            status=args.get('status'),
+            venue=args.get('venue'),
+            sort=args.get('sort', 'date'),
+            cursor=args.get('cursor'),
+            limit=args.get('limit', 50),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'bills': bills, 'next_cursor': next_cursor})
+
+@api.route('/history/stats', methods=['GET'])
+def bill_stats():
+    return jsonify(history.stats(user_id=current_user(), month=request.args.get('month')))
+
+@api.route('/history/participants/recent', methods=['GET'])
+def recent_participants():
+    try:
+        days = float(request.args.get('days', 30))
+        limit = min(int(request.args.get('limit', 10)), 100)
+    except ValueError:
+        return jsonify({'error': '"days" and "limit" must be numbers'}), 400
+    return jsonify({'participants': history.recent_participants(user_id=current_user(), days=days, limit=limit)})
+
+@api.route('/sync', methods=['GET'])
+def sync_bills():
+    # Delta sync for the mobile app: only bills saved or deleted after the
+    # client's `since` version, with a cheap 304 when nothing has changed
+    user_id = current_user()
+    since = request.args.get('since')
+    try:
+        since = int(since) if since not in (None, '') else None
+        limit = max(1, min(int(request.args.get('limit', MAX_SYNC_BATCH)), MAX_SYNC_BATCH))
+    except ValueError:
+        return jsonify({'error': '"since" and "limit" must be integers'}), 400
+    fmt = sync.negotiate(request.accept_mimetypes, request.args.get('format'))
+
+    tag = sync.etag(user_id, since, limit, history.current_version(user_id), fmt)
+    headers = {'Cache-Control': 'private, no-cache', 'Vary': 'Accept, Accept-Encoding, X-User-Id'}
+    if request.if_none_match.contains_weak(tag):
+        sync.SYNC_RESPONSES.inc(kind='not_modified')
+        response = Response(status=304, headers=headers)
+        response.set_etag(tag, weak=True)
+        return response
+
+    bills, deleted, version, has_more = history.changes_since(user_id, since, limit)
+    body = sync.encode({'bills': bills, 'deleted': deleted, 'version': version, 'has_more': has_more}, fmt)
+    body, encoding = sync.compress(body, request.accept_encodings)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    sync.SYNC_RESPONSES.inc(kind='full' if since is None else 'delta')
+    sync.SYNC_BYTES.observe(len(body), format=fmt, encoding=encoding or 'identity')
+    response = Response(body, mimetype=sync.MEDIA_TYPES[fmt], headers=headers)
+    response.set_etag(tag, weak=True)
+    return response
+
+@api.route('/history/<bill_id>', methods=['GET'])
+def get_bill(bill_id):
+    bill = history.get(bill_id, user_id=current_user())
+    if bill is None:
+        return jsonify({'error': 'Bill not found'}), 404
+    return jsonify(bill)
+
+@api.route('/history/<bill_id>', methods=['DELETE'])
+def delete_bill(bill_id):
+    if not history.delete(bill_id, user_id=current_user()):
+        return jsonify({'error': 'Bill not found'}), 404
+    return '', 204
+
+@api.cli.command('rebuild-rollups')
+def rebuild_rollups():
+    """Recompute the bill history rollups from the bills table."""
+    started = time.monotonic()
+    count = history.rebuild_rollups()
+    print(f'Rebuilt rollups from {count} bills in {time.monotonic() - started:.2f}s')
+
+@api.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(parse_cache.stats())
+
+@api.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    # Limits shown are this worker's share; `processes` workers share the totals
+    return jsonify(dict(admission.stats(), processes=ADMISSION_PROCESSES))
+
+@api.route('/parse/stats', methods=['GET'])
+def parse_stats():
+    return jsonify(local_parser.stats())
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not metrics.ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/healthz', methods=['GET'])
+def healthz():
+    # Load balancers stop routing to a worker once it starts draining
+    if shutting_down.is_set():
+        return jsonify({'status': 'draining'}), 503
+    return jsonify({'status': 'ok'})
+
+def drain(timeout=30):
+    # Graceful shutdown, called after the server has finished its in-flight
+    # requests (see worker_exit in gunicorn.conf.py): refuse new background
+    # parses and give the queued ones up to `timeout` seconds. Returns the
+    # number of parse jobs that had to be abandoned.
+    shutting_down.set()
+    remaining = parse_jobs.drain(timeout)
+    batch_pool.shutdown(wait=False, cancel_futures=True)
+    uploads.stop_sweeper()
+    return remaining
+
+def warm_up():
+    # Heavy dependencies and connections are set up on first use so that
+    # startup stays fast. With WARM_UP=1 they are set up before the app
+    # serves instead, so the first request does not pay for them.
+    started = time.monotonic()
+    db.connect()
+    preprocessor.warm_up()
+    numpy_module()
+    parser_backend.warm_up()
+    return time.monotonic() - started
+
+def create_app(config=None, warm=None):
+    app = Flask(__name__)
+    app.config.from_mapping(config or {})
+    app.register_blueprint(api)
+    if warm if warm is not None else os.getenv('WARM_UP') == '1':
+        warm_up()
+    return app
+
+# Built once at import and served by `flask --app app run`, the dev server
+# below and gunicorn (gunicorn -c gunicorn.conf.py app:app). Calling
+# create_app() again builds a second app and, with WARM_UP=1, warms up again.
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
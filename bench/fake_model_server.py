@@ -0,0 +1,139 @@
+# OpenAI-compatible fake of POST /v1/chat/completions for load tests and for
+# exercising model_client.py (pooling, retries, circuit breaker) without
+# network access. Answers are the same deterministic item lists FakeBackend
+# produces for the image in the request.
+#
+#     python bench/fake_model_server.py --port 8600 --latency 0.8 --failure-rate 0.05
+#     PARSER_BACKEND=openai OPENAI_BASE_URL=http://127.0.0.1:8600/v1 flask --app app run
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsers import FakeBackend  # noqa: E402
+
+
+class FakeModelHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.requests += 1
+            fail = server.rng.random() < server.failure_rate
+            # Scripted failures for tests, ahead of the random ones
+            if server.fail_next:
+                server.fail_next -= 1
+                fail = True
+            delay = max(0.0, server.rng.gauss(server.latency, server.jitter)) if server.jitter else server.latency
+        if not self.path.endswith('/chat/completions'):
+            return self._json(404, {'error': {'message': 'Not found'}})
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._json(400, {'error': {'message': 'Invalid JSON'}})
+        if fail:
+            time.sleep(delay / 4)
+            status = server.failure_status
+            headers = {'Retry-After': '1'} if status == 429 else {}
+            return self._json(status, {'error': {'message': 'Simulated provider failure'}}, headers)
+
+        content = json.dumps(server.items.items_for(_image_bytes(payload)))
+        if payload.get('stream'):
+            return self._stream(content, delay)
+        time.sleep(delay)
+        self._json(200, {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'model': payload.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        })
+
+    def _json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, content, delay, chunk_size=8):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pieces = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        for piece in pieces:
+            time.sleep(delay / len(pieces))
+            event = {'choices': [{'index': 0, 'delta': {'content': piece}}]}
+            self._chunk(f'data: {json.dumps(event)}\n\n'.encode())
+        self._chunk(b'data: [DONE]\n\n')
+        self._chunk(b'')
+
+    def _chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+def _image_bytes(payload):
+    for message in payload.get('messages', []):
+        content = message.get('content')
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            url = part.get('image_url', {}).get('url', '') if part.get('type') == 'image_url' else ''
+            if url.startswith('data:') and ',' in url:
+                return base64.b64decode(url.split(',', 1)[1])
+    return b''
+
+
+def serve(port=0, latency=0.8, jitter=0.3, failure_rate=0.0, failure_status=500, seed=0):
+    # Starts the server on a background thread; port 0 picks a free port.
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeModelHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.failure_rate = failure_rate
+    server.failure_status = failure_status
+    server.rng = random.Random(seed)
+    server.items = FakeBackend()
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.fail_next = 0
+    threading.Thread(target=server.serve_forever, name='fake-model-server', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI-compatible chat completions server')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--latency', type=float, default=0.8)
+    parser.add_argument('--jitter', type=float, default=0.3)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--failure-status', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.jitter, args.failure_rate, args.failure_status, args.seed)
+    print(f'Fake model server on http://127.0.0.1:{server.server_address[1]}/v1', file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+# Load test for /upload and /split.
+#
+# By default this starts app.py on a free local port with the fake parser
+# backend (PARSER_BACKEND=fake, see parsers.py) in a scratch directory, so no
+# network access or model spend is involved:
+#
+#     python bench/loadtest.py --requests 200 --concurrency 16 --output results.json
+#
+# With --model-server the app instead uses the real OpenAI backend and model
+# client against bench/fake_model_server.py, so connection pooling, retries
+# and the circuit breaker are part of the measurement.
+#
+# --server gunicorn runs the production configuration (gunicorn.conf.py)
+# instead of the Flask dev server.
+#
+# Point --url at an already running server to measure that instead. Per-stage
+# timings come from the Server-Timing header that /upload sets. Pass
+# --baseline with an earlier results file to print the relative change.
+
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_receipts  # noqa: E402
+from fake_model_server import serve as serve_fake_model  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(latencies):
+    return {
+        'count': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'max_ms': _ms(max(latencies) if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def parse_server_timing(header):
+    stages = {}
+    for part in (header or '').split(','):
+        fields = [f.strip() for f in part.split(';')]
+        if not fields[0]:
+            continue
+        for field in fields[1:]:
+            if field.startswith('dur='):
+                stages[fields[0]] = float(field[4:]) / 1000
+    return stages
+
+
+def load_corpus(corpus_dir, size, seed):
+    if corpus_dir:
+        paths = sorted(os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir)
+                       if name.lower().endswith(('.jpg', '.jpeg', '.png', '.heic', '.webp')))
+        if not paths:
+            raise SystemExit(f'No images found in {corpus_dir}')
+        corpus = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                corpus.append((os.path.basename(path), f.read()))
+        return corpus
+    if importlib.util.find_spec('PIL') is None:
+        raise SystemExit('Synthetic receipts need Pillow (pip install pillow), or pass --corpus')
+    return synthetic_receipts.generate(size, seed)
+
+
+def multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    return head + data + f'\r\n--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+def request(url, body, content_type, method='POST'):
+    req = urllib.request.Request(url, data=body, method=method, headers={'Content-Type': content_type})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            payload = resp.read()
+            status, headers = resp.status, resp.headers
+    except urllib.error.HTTPError as e:
+        payload, status, headers = e.read(), e.code, e.headers
+    except (urllib.error.URLError, OSError) as e:
+        return {'ok': False, 'status': None, 'latency': time.perf_counter() - started, 'error': str(e)}
+    latency = time.perf_counter() - started
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        data = None
+    return {
+        'ok': 200 <= status < 300,
+        'status': status,
+        'latency': latency,
+        'data': data,
+        'stages': parse_server_timing(headers.get('Server-Timing')),
+    }
+
+
+def run_phase(name, total, concurrency, task):
+    results = []
+    lock = threading.Lock()
+
+    def worker(i):
+        result = task(i)
+        with lock:
+            results.append(result)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(total)))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if r['ok']]
+    statuses = {}
+    for r in results:
+        statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+    stage_names = sorted({stage for r in ok for stage in r.get('stages', {})})
+    report = {
+        'requests': total,
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_sec': round(total / elapsed, 3) if elapsed else None,
+        'errors': total - len(ok),
+        'statuses': statuses,
+        'latency': summarize([r['latency'] for r in ok]),
+        'stages': {stage: summarize([r['stages'][stage] for r in ok if stage in r['stages']])
+                   for stage in stage_names},
+    }
+    print(f'{name}: {report["requests_per_sec"]} req/s, p50 {report["latency"]["p50_ms"]} ms, '
+          f'p95 {report["latency"]["p95_ms"]} ms, p99 {report["latency"]["p99_ms"]} ms, '
+          f'{report["errors"]} errors', file=sys.stderr)
+    return report, results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args):
+    workdir = tempfile.mkdtemp(prefix='tabtogether-bench-')
+    port = free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''),
+        PARSER_BACKEND='fake',
+        FAKE_PARSER_LATENCY=str(args.fake_latency),
+        FAKE_PARSER_JITTER=str(args.fake_jitter),
+        FAKE_PARSER_FAILURE_RATE=str(args.fake_failure_rate),
+        FAKE_PARSER_SEED=str(args.seed),
+        DATABASE_PATH=os.path.join(workdir, 'bench.db'),
+    )
+    model_server = None
+    if args.model_server:
+        model_server = serve_fake_model(latency=args.fake_latency, jitter=args.fake_jitter,
+                                        failure_rate=args.fake_failure_rate, seed=args.seed)
+        env.update(PARSER_BACKEND='openai', OPENAI_API_KEY='fake',
+                   OPENAI_BASE_URL=f'http://127.0.0.1:{model_server.server_address[1]}/v1')
+    if args.server == 'gunicorn':
+        # The production configuration, see gunicorn.conf.py
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+                   '--bind', f'127.0.0.1:{port}', 'app:app']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port),
+                   '--no-reload', '--no-debugger', '--with-threads']
+    proc = subprocess.Popen(
+        command,
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit('Server exited during startup')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return proc, url
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit('Server did not start within 30s')
+
+
+def compare(current, baseline):
+    for phase in ('upload', 'split'):
+        if phase not in current or phase not in baseline:
+            continue
+        _print_delta(f'{phase} requests_per_sec', baseline[phase]['requests_per_sec'], current[phase]['requests_per_sec'])
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            _print_delta(f'{phase} {key}', baseline[phase]['latency'][key], current[phase]['latency'][key])
+
+
+def _print_delta(label, old, new):
+    if old and new is not None:
+        print(f'{label}: {old} -> {new} ({(new - old) / old * 100:+.1f}%)', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /upload and /split')
+    parser.add_argument('--url', help='Benchmark an already running server instead of starting one')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per phase')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--corpus', help='Directory of receipt images (default: synthetic receipts, see synthetic_receipts.py)')
+    parser.add_argument('--corpus-size', type=int, default=20)
+    parser.add_argument('--repeat', action='store_true',
+                        help='Re-send corpus images unchanged so the parse cache can hit; '
+                             'by default every upload gets a unique suffix')
+    parser.add_argument('--people', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fake-latency', type=float, default=0.8)
+    parser.add_argument('--fake-jitter', type=float, default=0.3)
+    parser.add_argument('--fake-failure-rate', type=float, default=0.0)
+    parser.add_argument('--model-server', action='store_true',
+                        help='Use the OpenAI backend against a local fake model server instead of the in-process fake')
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask',
+                        help='Serve the app with the Flask dev server or the production gunicorn configuration')
+    parser.add_argument('--output', help='Write results JSON here (default: stdout)')
+    parser.add_argument('--baseline', help='Earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.corpus_size, args.seed)
+    proc = None
+    url = args.url
+    if not url:
+        proc, url = start_server(args)
+    try:
+        def upload_task(i):
+            filename, data = corpus[i % len(corpus)]
+            if not args.repeat:
+                data += uuid.uuid4().bytes
+            body, content_type = multipart('file', filename, data)
+            return request(f'{url}/upload', body, content_type)
+
+        upload_report, upload_results = run_phase('upload', args.requests, args.concurrency, upload_task)
+        receipt_ids = [r['data']['receipt_id'] for r in upload_results if r['ok'] and r['data']]
+        results = {
+            'version': 1,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'target': args.url or ('local (fake model server)' if args.model_server else 'local (fake parser backend)'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+            'upload': upload_report,
+        }
+        if receipt_ids:
+            def split_task(i):
+                body = json.dumps({'receipt_id': receipt_ids[i % len(receipt_ids)], 'people': args.people}).encode()
+                return request(f'{url}/split', body, 'application/json')
+
+            results['split'], _ = run_phase('split', args.requests, args.concurrency, split_task)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Cold start benchmark: how long a fresh process takes to import app.py
+# and answer its first /upload and /split requests.
+#
+# Each run starts a new interpreter in a scratch directory with the fake
+# parser backend, so nothing is cached between runs:
+#
+#     python bench/startup.py --runs 10 --output startup.json
+#
+# --warm sets WARM_UP=1, moving first-use setup (database schema, Pillow,
+# numpy, the model connection) into startup. --profile-imports prints the
+# slowest imports of one run. With --baseline and --max-regression the
+# script exits non-zero when time to first response has regressed by more
+# than that percentage, so it can gate CI.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import summarize  # noqa: E402
+
+PROBE = '''
+import io, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+upload = client.post('/upload', data={'file': (io.BytesIO(b'\\xff\\xd8\\xff\\xe0' + bytes(range(256)) * 64), 'receipt.jpg')})
+uploaded = time.perf_counter()
+split = client.post('/split', json={'receipt_id': upload.get_json()['receipt_id'], 'people': 2})
+finished = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'first_upload': uploaded - imported,
+    'first_split': finished - uploaded,
+    'statuses': [upload.status_code, split.status_code],
+}))
+'''
+
+
+def run_once(args, workdir, importtime=False):
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''),
+        PARSER_BACKEND='fake',
+        FAKE_PARSER_LATENCY='0',
+        FAKE_PARSER_JITTER='0',
+        DATABASE_PATH=os.path.join(workdir, 'startup.db'),
+        WARM_UP='1' if args.warm else '0',
+    )
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE]
+    started = time.perf_counter()
+    proc = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True, timeout=120)
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise SystemExit(f'Probe failed:\n{proc.stderr}')
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    if result['statuses'] != [200, 200]:
+        raise SystemExit(f'Probe requests failed with {result["statuses"]}')
+    # The process includes interpreter startup and exit on top of the probe
+    result['process'] = elapsed
+    return result, proc.stderr
+
+
+def print_slowest_imports(stderr, count=15):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # import time: <self us> | <cumulative us> | <indented module name>
+        self_us, cumulative_us, name = (part.strip() for part in line.split(':', 1)[1].split('|'))
+        rows.append((int(cumulative_us), int(self_us), name))
+    print('slowest imports (cumulative ms, self ms):', file=sys.stderr)
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:count]:
+        print(f'  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark for app.py')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--warm', action='store_true', help='Start with WARM_UP=1')
+    parser.add_argument('--profile-imports', action='store_true', help='Print the slowest imports of one run')
+    parser.add_argument('--output', help='Write results JSON here (default: stdout)')
+    parser.add_argument('--baseline', help='Earlier results JSON to compare against')
+    parser.add_argument('--max-regression', type=float,
+                        help='With --baseline, fail if p50 time to first response grew by more than this percent')
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        # A fresh directory per run, so there is no database or upload to reuse
+        with tempfile.TemporaryDirectory(prefix='tabtogether-startup-') as workdir:
+            runs.append(run_once(args, workdir)[0])
+    if args.profile_imports:
+        with tempfile.TemporaryDirectory(prefix='tabtogether-startup-') as workdir:
+            print_slowest_imports(run_once(args, workdir, importtime=True)[1])
+
+    phases = ('import', 'first_upload', 'first_split', 'process')
+    results = {
+        'version': 1,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {'runs': args.runs, 'warm': args.warm, 'python': sys.version.split()[0]},
+        'phases': {phase: summarize([run[phase] for run in runs]) for phase in phases},
+        'first_response': summarize([run['import'] + run['first_upload'] for run in runs]),
+    }
+    for phase in phases + ('first_response',):
+        summary = results['first_response'] if phase == 'first_response' else results['phases'][phase]
+        print(f'{phase}: p50 {summary["p50_ms"]} ms, p95 {summary["p95_ms"]} ms', file=sys.stderr)
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        old, new = baseline['first_response']['p50_ms'], results['first_response']['p50_ms']
+        change = (new - old) / old * 100
+        print(f'first_response p50_ms: {old} -> {new} ({change:+.1f}%)', file=sys.stderr)
+        if args.max_regression is not None and change > args.max_regression:
+            print(f'Startup regressed by more than {args.max_regression:g}%', file=sys.stderr)
+            failed = True
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
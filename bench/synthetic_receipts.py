@@ -0,0 +1,102 @@
+# Synthetic receipt photos for the benchmarks: a white receipt with item
+# lines, a subtotal, tax and total, slightly rotated on a darker table, saved
+# as a phone-sized JPEG. They decode, get cropped by the preprocessor and,
+# with Tesseract installed, can be read by the local OCR tier, so the whole
+# upload pipeline is exercised. The same seed always gives the same images.
+#
+# To write a sample set to disk, e.g. for `loadtest.py --corpus`:
+#
+#     python bench/synthetic_receipts.py --output receipts/ --count 20
+
+import argparse
+import io
+import os
+import random
+
+VENUES = ['THAI GARDEN', "JOE'S PIZZA", 'BLUE BOTTLE CAFE', 'TACO STAND', 'THE CORNER PUB', 'SUSHI BAR']
+ITEMS = [
+    ('Pad Thai', 14.25), ('Burger', 12.99), ('Fries', 4.50), ('Soda', 2.99), ('Caesar Salad', 9.75),
+    ('Cheesecake', 7.50), ('Nachos', 8.75), ('Lemonade', 3.50), ('Onion Rings', 5.25), ('Latte', 4.75),
+    ('Margherita Pizza', 16.00), ('Iced Tea', 2.75), ('Fish Tacos', 11.50), ('Miso Soup', 3.25),
+]
+TAX_RATE = 0.0875
+PHOTO_SIZE = (1512, 2016)
+
+
+def _font(size):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+def receipt_lines(rng):
+    # Plain strings are centred; (label, amount) pairs are printed in two columns
+    items = []
+    for name, price in rng.sample(ITEMS, rng.randint(3, 8)):
+        items.append((rng.choice([1, 1, 1, 2, 3]), name, price))
+    subtotal = round(sum(qty * price for qty, _, price in items), 2)
+    tax = round(subtotal * TAX_RATE, 2)
+    lines = [rng.choice(VENUES), f'Table {rng.randint(1, 30)}  Server {rng.choice(["Ana", "Ben", "Kim"])}', '']
+    for qty, name, price in items:
+        lines.append((f'{qty} {name}' if qty > 1 else name, f'{qty * price:.2f}'))
+    lines += ['', ('Subtotal', f'{subtotal:.2f}'), ('Tax', f'{tax:.2f}'), ('Total', f'{subtotal + tax:.2f}'),
+              '', 'THANK YOU!']
+    return lines
+
+
+def render(rng, quality=88):
+    from PIL import Image, ImageDraw, ImageFilter
+
+    lines = receipt_lines(rng)
+    font = _font(40)
+    line_height = 56
+    paper = Image.new('L', (760, 140 + line_height * len(lines)), 250)
+    draw = ImageDraw.Draw(paper)
+    y = 70
+    for line in lines:
+        if isinstance(line, tuple):
+            label, amount = line
+            draw.text((50, y), label, font=font, fill=20)
+            draw.text((710, y), amount, font=font, fill=20, anchor='ra')
+        elif line:
+            draw.text((380, y), line, font=font, fill=20, anchor='ma')
+        y += line_height
+
+    photo = Image.new('L', PHOTO_SIZE, rng.randint(60, 110))
+    paper = paper.rotate(rng.uniform(-3, 3), resample=Image.BICUBIC, expand=True, fillcolor=photo.getpixel((0, 0)))
+    scale = min(0.8 * PHOTO_SIZE[0] / paper.width, 0.85 * PHOTO_SIZE[1] / paper.height)
+    paper = paper.resize((int(paper.width * scale), int(paper.height * scale)), Image.LANCZOS)
+    photo.paste(paper, ((PHOTO_SIZE[0] - paper.width) // 2, (PHOTO_SIZE[1] - paper.height) // 2))
+    # A little blur and sensor noise, as in a real photo
+    photo = photo.filter(ImageFilter.GaussianBlur(0.8))
+    noise = Image.frombytes('L', PHOTO_SIZE, rng.randbytes(PHOTO_SIZE[0] * PHOTO_SIZE[1]))
+    photo = Image.blend(photo, noise, 0.05).convert('RGB')
+    out = io.BytesIO()
+    photo.save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+
+def generate(count, seed=0):
+    # [(filename, jpeg_bytes)]
+    rng = random.Random(seed)
+    return [(f'receipt_{i}.jpg', render(rng)) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic receipt photos')
+    parser.add_argument('--output', required=True, help='Directory to write the images to')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    for filename, data in generate(args.count, args.seed):
+        with open(os.path.join(args.output, filename), 'wb') as f:
+            f.write(data)
+
+
+if __name__ == '__main__':
+    main()
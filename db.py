@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class Database:
+    # One SQLite connection per thread, in WAL mode so readers in other
+    # threads and worker processes are never blocked by a writer. Nothing
+    # touches the file until the first query, so creating stores is free at
+    # startup; their schemas are applied then, in registration order.
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._setup = []
+        self._setup_lock = threading.RLock()
+
+    def add_schema(self, script):
+        self.add_setup(lambda conn: conn.executescript(script))
+
+    def add_setup(self, fn):
+        # `fn(conn)` runs once, before the first query that follows it
+        with self._setup_lock:
+            self._setup.append(fn)
+
+    def connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        if self._setup and not getattr(self._local, 'in_setup', False):
+            self._run_setup(conn)
+        return conn
+
+    def _run_setup(self, conn):
+        with self._setup_lock:
+            self._local.in_setup = True
+            try:
+                while self._setup:
+                    self._setup[0](conn)
+                    self._setup.pop(0)
+            finally:
+                self._local.in_setup = False
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so read-modify-write
+        # sequences cannot interleave across processes.
+        conn = self.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
@@ -0,0 +1,198 @@
+import json
+import math
+import re
+
+from metrics import registry, Counter
+
+DECODE_RESULTS = registry.register(Counter(
+    'tabtogether_decode_total', 'Model responses decoded, by outcome', ['outcome']))
+DECODE_REPAIRS = registry.register(Counter(
+    'tabtogether_decode_repairs_total', 'Local fixes applied to model responses, by kind', ['kind']))
+DECODE_RETRIES = registry.register(Counter(
+    'tabtogether_decode_retries_total', 'Model calls repeated because the response could not be repaired'))
+
+# Requested from backends that support schema-constrained output. Strict
+# mode needs an object at the top level, so the array is wrapped in one.
+ITEMS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'items': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'item': {'type': 'string'},
+                    'price': {'type': 'number'},
+                    'quantity': {'type': 'integer'},
+                },
+                'required': ['item', 'price', 'quantity'],
+                'additionalProperties': False,
+            },
+        },
+    },
+    'required': ['items'],
+    'additionalProperties': False,
+}
+
+_FENCE = re.compile(r'```[A-Za-z]*\s*(.*?)\s*```', re.DOTALL)
+_TRAILING_COMMA = re.compile(r',\s*([\]}])')
+_SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '‘': "'", '’': "'"})
+_NOT_NUMERIC = re.compile(r'[^\d.,\s-]')
+_NUMBER = re.compile(r'-?\d[\d.,\s]*')
+
+
+class DecodeError(ValueError):
+    status_code = 502
+
+
+def decode_items(text):
+    # Turns the model's answer into a list of {item, price[, quantity]}
+    # dicts. Returns (items, repairs) where repairs lists the kinds of local
+    # fixes that were needed; raises DecodeError when nothing usable is left.
+    repairs = []
+    value = _extract_json(text, repairs)
+    if isinstance(value, dict):
+        lists = [v for v in value.values() if isinstance(v, list)]
+        if 'items' in value and isinstance(value['items'], list):
+            value = value['items']
+        elif len(lists) == 1:
+            value = lists[0]
+            repairs.append('unwrapped')
+    if not isinstance(value, list):
+        raise DecodeError(f'Expected a JSON array of items, got {type(value).__name__}')
+    items = []
+    for raw in value:
+        item = normalize_item(raw, repairs)
+        if item is not None:
+            items.append(item)
+    if value and not items:
+        raise DecodeError('None of the items in the model response were usable')
+    return items, repairs
+
+
+def normalize_item(raw, repairs):
+    # Validates one entry against the Item shape the rest of the service
+    # expects and fixes what can be fixed; returns None for entries that
+    # cannot be used, which are dropped.
+    if not isinstance(raw, dict):
+        repairs.append('dropped')
+        return None
+    name = raw.get('item', raw.get('name'))
+    if 'item' not in raw and name is not None:
+        repairs.append('name_key')
+    if not isinstance(name, str) or not name.strip():
+        repairs.append('dropped')
+        return None
+    price = raw.get('price')
+    if not isinstance(price, (int, float)) or isinstance(price, bool):
+        price = parse_price(price)
+        if price is None:
+            repairs.append('dropped')
+            return None
+        repairs.append('price')
+    if not math.isfinite(price):
+        repairs.append('dropped')
+        return None
+    item = {'item': name.strip(), 'price': round(float(price), 2)}
+    quantity = raw.get('quantity', 1)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        try:
+            quantity = max(1, int(float(str(quantity).strip())))
+        except (ValueError, OverflowError):
+            quantity = 1
+        repairs.append('quantity')
+    if quantity != 1:
+        item['quantity'] = quantity
+    return item
+
+
+def load_item(text, repairs):
+    # For streamed responses, which arrive one object at a time: decodes and
+    # normalizes the text of a single item. Syntax slips are repaired as in
+    # decode_items; objects that still cannot be read are dropped (None).
+    try:
+        raw = json.loads(text)
+    except ValueError:
+        try:
+            raw = json.loads(_repair_syntax(text))
+        except ValueError:
+            repairs.append('dropped')
+            return None
+        repairs.append('syntax')
+    return normalize_item(raw, repairs)
+
+
+def parse_price(value):
+    # '$4.50', '4,50 €', 'USD 1,234.50' -> float; None when there is no number
+    if not isinstance(value, str):
+        return None
+    match = _NUMBER.search(_NOT_NUMERIC.sub('', value.replace('−', '-')))
+    if match is None:
+        return None
+    number = re.sub(r'\s', '', match.group()).rstrip('.,')
+    if ',' in number and '.' in number:
+        # Whichever separator comes last is the decimal point
+        if number.rfind(',') > number.rfind('.'):
+            number = number.replace('.', '').replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif ',' in number:
+        # Groups of three digits are thousands, anything shorter is a decimal comma
+        head, _, tail = number.rpartition(',')
+        number = number.replace(',', '') if len(tail) == 3 else f'{head.replace(",", "")}.{tail}'
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def record(repairs):
+    DECODE_RESULTS.inc(outcome='repaired' if repairs else 'clean')
+    for kind in set(repairs):
+        DECODE_REPAIRS.inc(kind=kind)
+
+
+def record_failure(retrying):
+    DECODE_RESULTS.inc(outcome='failed')
+    if retrying:
+        DECODE_RETRIES.inc()
+
+
+def _extract_json(text, repairs):
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        pass
+    if not isinstance(text, str):
+        raise DecodeError('Model response was empty')
+    candidate = text
+    fence = _FENCE.search(candidate)
+    if fence:
+        candidate = fence.group(1)
+        repairs.append('fence')
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            pass
+    # Prose around the JSON: take the outermost array or object
+    starts = [i for i in (candidate.find('['), candidate.find('{')) if i != -1]
+    if starts:
+        start = min(starts)
+        end = candidate.rfind(']' if candidate[start] == '[' else '}')
+        if end > start and (start > 0 or end < len(candidate) - 1):
+            candidate = candidate[start:end + 1]
+            repairs.append('extracted')
+            try:
+                return json.loads(candidate)
+            except ValueError:
+                pass
+    try:
+        value = json.loads(_repair_syntax(candidate))
+    except ValueError as e:
+        raise DecodeError(f'Model response is not valid JSON: {e}')
+    repairs.append('syntax')
+    return value
+
+
+def _repair_syntax(text):
+    return _TRAILING_COMMA.sub(r'\1', text.translate(_SMART_QUOTES))
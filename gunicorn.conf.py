@@ -0,0 +1,63 @@
+# Production server settings:
+#
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# Request handlers spend almost all of their time waiting on the model
+# provider, so each worker process runs many requests at once: WEB_THREADS
+# threads with the default gthread worker, or WEB_WORKER_CONNECTIONS
+# greenlets with WEB_WORKER_CLASS=gevent (pip install gevent; run
+# preprocessing with PREPROCESS_EXECUTOR=process so it does not block the
+# event loop). Size MODEL_POOL_SIZE to match, since a parse waits for a
+# pooled model connection.
+#
+# On SIGTERM a worker stops accepting connections, /healthz starts
+# returning 503, in-flight requests get up to GRACEFUL_TIMEOUT seconds to
+# finish, and queued ?async=1 parses are drained in the time that is left.
+# An async parse runs in the worker that accepted it, but its status is in
+# the shared database, so /jobs/<id> can be polled through any worker.
+import os
+import signal
+import time
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+# Workers split the model admission budget between them (see app.py), so
+# they need to know how many of them there are
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WEB_THREADS', 64))
+worker_connections = int(os.getenv('WEB_WORKER_CONNECTIONS', 1000))
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 60))
+timeout = int(os.getenv('WORKER_TIMEOUT', 120))
+keepalive = int(os.getenv('KEEPALIVE', 5))
+# The app starts thread pools at import (and the upload sweeper thread on
+# the first upload), which would not survive the fork, so every worker
+# imports it itself
+preload_app = False
+accesslog = os.getenv('ACCESS_LOG') or None
+
+
+def post_worker_init(worker):
+    import app as tabtogether
+
+    worker.drain_deadline = None
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_term(signum, frame):
+        tabtogether.shutting_down.set()
+        worker.drain_deadline = time.monotonic() + graceful_timeout
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_exit(server, worker):
+    import app as tabtogether
+
+    # Leave a second for the process to exit before the arbiter kills it
+    deadline = getattr(worker, 'drain_deadline', None)
+    remaining = max(0.0, deadline - time.monotonic() - 1) if deadline else graceful_timeout - 1
+    abandoned = tabtogether.drain(remaining)
+    if abandoned:
+        server.log.warning('Worker %s exiting with %d parse jobs unfinished', worker.pid, abandoned)
@@ -0,0 +1,300 @@
+import base64
+import json
+import math
+import re
+from datetime import datetime, timezone
+
+import rollups
+
+# Bill ids are generated by the app, so they are only unique per user.
+# `version` is the row's position on the sync clock (see SYNC_SCHEMA).
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bills (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    user_id TEXT NOT NULL DEFAULT '',
+    date REAL NOT NULL,
+    venue TEXT NOT NULL,
+    total_amount REAL NOT NULL,
+    participant_count INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    UNIQUE (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_bills_user_date ON bills(user_id, date, id);
+CREATE INDEX IF NOT EXISTS idx_bills_user_venue ON bills(user_id, venue COLLATE NOCASE, date);
+CREATE INDEX IF NOT EXISTS idx_bills_user_amount ON bills(user_id, total_amount, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS bills_fts USING fts5(venue, items, participants, tokenize='unicode61 remove_diacritics 2');
+'''
+
+# Every save and delete takes the next value of a single counter, so a
+# client that remembers the highest version it has seen can ask for
+# everything after it. Deletes leave a tombstone carrying their version.
+SYNC_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS history_clock (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO history_clock (id, version) VALUES (1, 0);
+CREATE INDEX IF NOT EXISTS idx_bills_user_version ON bills(user_id, version);
+CREATE TABLE IF NOT EXISTS bill_tombstones (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_bill_tombstones_version ON bill_tombstones(user_id, version);
+'''
+
+SORTS = {'date': 'date', 'amount': 'total_amount'}
+MAX_PAGE_SIZE = 200
+MAX_SYNC_BATCH = 1000
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def parse_date(value):
+    # Accepts ISO 8601 dates and datetimes, including JS toISOString() output
+    if isinstance(value, (int, float)):
+        if not math.isfinite(value):
+            raise InvalidQuery(f'Invalid date: {value!r}')
+        return float(value)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise InvalidQuery(f'Invalid date: {value!r}')
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidQuery('Invalid cursor')
+    if not isinstance(values, list) or len(values) != 3:
+        raise InvalidQuery('Invalid cursor')
+    return values
+
+
+def match_expression(query):
+    # Every word must match, as a prefix, somewhere in the venue, item names
+    # or participant names. Words are quoted so FTS syntax in user input is
+    # treated as text.
+    terms = _TERM.findall(query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def history_item(receipt, image_uri=''):
+    # Mirrors BillHistoryItem in TabTogetherFrontend/types/Bill.ts
+    return {
+        'id': receipt['id'],
+        'date': receipt['timestamp'],
+        'venue': receipt.get('venue') or 'Unknown Venue',
+        'totalAmount': receipt.get('totalAmount', 0),
+        'participantCount': len(receipt.get('participants', [])),
+        'imageUri': image_uri,
+        'status': 'processed' if receipt.get('isProcessed') else 'pending',
+        'receipt': receipt,
+    }
+
+
+class BillHistory:
+    # Server-side replacement for the AsyncStorage blob in
+    # BillStorageService.ts. Each bill is one row, with the fields the app
+    # filters and sorts on pulled out into indexed columns, and an FTS5 table
+    # (sharing the row's seq as its rowid) over venue, item and participant
+    # names. Listing uses keyset pagination on (sort column, id), so a page
+    # costs the same however deep into the history it is.
+
+    def __init__(self, db):
+        self.db = db
+        db.add_schema(SCHEMA)
+        db.add_schema(SYNC_SCHEMA)
+        db.add_schema(rollups.SCHEMA)
+
+    def _next_version(self, conn):
+        conn.execute('UPDATE history_clock SET version = version + 1 WHERE id = 1')
+        return conn.execute('SELECT version FROM history_clock WHERE id = 1').fetchone()['version']
+
+    def save(self, receipt, image_uri='', user_id=''):
+        item = history_item(receipt, image_uri)
+        # JSON bodies may carry NaN or Infinity, which neither SQLite nor the
+        # cent rollups can store
+        amount = float(item['totalAmount'])
+        if not math.isfinite(amount):
+            raise ValueError(f'totalAmount must be a finite number, got {item["totalAmount"]!r}')
+        row = (
+            item['id'], user_id, parse_date(item['date']), item['venue'], amount,
+            item['participantCount'], item['status'], json.dumps(item),
+        )
+        with self.db.transaction() as conn:
+            row += (self._next_version(conn),)
+            existing = conn.execute(
+                'SELECT seq, date, data FROM bills WHERE id = ? AND user_id = ?', (item['id'], user_id)).fetchone()
+            if existing is None:
+                seq = conn.execute(
+                    'INSERT INTO bills (id, user_id, date, venue, total_amount, participant_count, status, data, version)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', row,
+                ).lastrowid
+                conn.execute('DELETE FROM bill_tombstones WHERE user_id = ? AND id = ?', (user_id, item['id']))
+            else:
+                seq = existing['seq']
+                rollups.remove_bill(conn, seq, user_id, existing['date'], json.loads(existing['data']))
+                conn.execute(
+                    'UPDATE bills SET date = ?, venue = ?, total_amount = ?,'
+                    ' participant_count = ?, status = ?, data = ?, version = ? WHERE seq = ?',
+                    row[2:] + (seq,),
+                )
+                conn.execute('DELETE FROM bills_fts WHERE rowid = ?', (seq,))
+            conn.execute(
+                'INSERT INTO bills_fts (rowid, venue, items, participants) VALUES (?, ?, ?, ?)',
+                (seq, item['venue'],
+                 ' '.join(i.get('name', '') for i in receipt.get('items', [])),
+                 ' '.join(p.get('name', '') for p in receipt.get('participants', []))),
+            )
+            rollups.add_bill(conn, seq, user_id, row[2], item)
+        return item
+
+    def get(self, bill_id, user_id=''):
+        row = self.db.connect().execute(
+            'SELECT data FROM bills WHERE id = ? AND user_id = ?', (bill_id, user_id)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def delete(self, bill_id, user_id=''):
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                'SELECT seq, date, data FROM bills WHERE id = ? AND user_id = ?', (bill_id, user_id)).fetchone()
+            if row is None:
+                return False
+            conn.execute('DELETE FROM bills WHERE seq = ?', (row['seq'],))
+            conn.execute('DELETE FROM bills_fts WHERE rowid = ?', (row['seq'],))
+            rollups.remove_bill(conn, row['seq'], user_id, row['date'], json.loads(row['data']))
+            self._tombstone(conn, user_id, bill_id)
+        return True
+
+    def _tombstone(self, conn, user_id, bill_id):
+        conn.execute(
+            'INSERT OR REPLACE INTO bill_tombstones (user_id, id, version) VALUES (?, ?, ?)',
+            (user_id, bill_id, self._next_version(conn)),
+        )
+
+    def current_version(self, user_id=''):
+        # Highest version of anything this user can see; both lookups are
+        # answered from the end of an index
+        conn = self.db.connect()
+        bills = conn.execute('SELECT max(version) AS v FROM bills WHERE user_id = ?', (user_id,)).fetchone()['v']
+        tombstones = conn.execute(
+            'SELECT max(version) AS v FROM bill_tombstones WHERE user_id = ?', (user_id,)).fetchone()['v']
+        return max(bills or 0, tombstones or 0)
+
+    def changes_since(self, user_id='', since=None, limit=MAX_SYNC_BATCH):
+        # Returns (bills, deleted_ids, version, has_more) for everything that
+        # changed after `since`, oldest change first. Without `since` every
+        # live bill is sent and no tombstones. `version` is the cursor for the
+        # next call; has_more means the batch was cut off at `limit`.
+        limit = max(1, min(int(limit), MAX_SYNC_BATCH))
+        after = -1 if since is None else int(since)
+        # Writers commit in version order, so nothing at or below `current`
+        # can appear later; anything newer is left for the next call
+        current = self.current_version(user_id)
+        conn = self.db.connect()
+        changes = [(row['version'], json.loads(row['data']), None) for row in conn.execute(
+            'SELECT version, data FROM bills WHERE user_id = ? AND version > ? AND version <= ? ORDER BY version LIMIT ?',
+            (user_id, after, current, limit + 1),
+        )]
+        if since is not None:
+            changes += [(row['version'], None, row['id']) for row in conn.execute(
+                'SELECT version, id FROM bill_tombstones WHERE user_id = ? AND version > ? AND version <= ?'
+                ' ORDER BY version LIMIT ?',
+                (user_id, after, current, limit + 1),
+            )]
+            changes.sort(key=lambda change: change[0])
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        version = changes[-1][0] if has_more else max(after, current, 0)
+        bills = [bill for _, bill, _ in changes if bill is not None]
+        deleted = [bill_id for _, _, bill_id in changes if bill_id is not None]
+        return bills, deleted, version, has_more
+
+    def stats(self, user_id='', month=None):
+        month = month or datetime.now(timezone.utc).strftime('%Y-%m')
+        conn = self.db.connect()
+        result = rollups.stats(conn, user_id, month)
+        result['months'] = rollups.breakdown(conn, 'rollup_month', user_id)
+        result['venues'] = rollups.breakdown(conn, 'rollup_venue', user_id)
+        return result
+
+    def recent_participants(self, user_id='', days=30, limit=10):
+        since = datetime.now(timezone.utc).timestamp() - days * 86400
+        return rollups.recent_participants(self.db.connect(), user_id, since, limit)
+
+    def rebuild_rollups(self):
+        with self.db.transaction() as conn:
+            return rollups.rebuild(conn)
+
+    def search(self, user_id='', query=None, date_from=None, date_to=None, min_amount=None, max_amount=None,
+               participant_count=None, status=None, venue=None, sort='date', cursor=None, limit=50):
+        # Returns (bills, next_cursor), newest (or largest) first. next_cursor
+        # is None on the last page.
+        if sort not in SORTS:
+            raise InvalidQuery(f'Unknown sort {sort!r}; expected one of {sorted(SORTS)}')
+        column = SORTS[sort]
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where = ['b.user_id = ?']
+        params = [user_id]
+        joins = ''
+        if query and query.strip():
+            expression = match_expression(query)
+            if not expression:
+                return [], None
+            joins = ' JOIN bills_fts f ON f.rowid = b.seq'
+            where.append('bills_fts MATCH ?')
+            params.append(expression)
+        if date_from is not None:
+            where.append('b.date >= ?')
+            params.append(parse_date(date_from))
+        if date_to is not None:
+            where.append('b.date <= ?')
+            params.append(parse_date(date_to))
+        if min_amount is not None:
+            where.append('b.total_amount >= ?')
+            params.append(float(min_amount))
+        if max_amount is not None:
+            where.append('b.total_amount <= ?')
+            params.append(float(max_amount))
+        if participant_count is not None:
+            where.append('b.participant_count = ?')
+            params.append(int(participant_count))
+        if status:
+            where.append('b.status = ?')
+            params.append(status)
+        if venue:
+            where.append('b.venue = ? COLLATE NOCASE')
+            params.append(venue)
+        if cursor:
+            cursor_sort, last_value, last_id = decode_cursor(cursor)
+            if cursor_sort != sort:
+                raise InvalidQuery('Cursor was issued for a different sort order')
+            where.append(f'(b.{column} < ? OR (b.{column} = ? AND b.id < ?))')
+            params.extend([last_value, last_value, last_id])
+        sql = (
+            f'SELECT b.id, b.{column} AS sort_value, b.data FROM bills b{joins}'
+            f' WHERE {" AND ".join(where)} ORDER BY b.{column} DESC, b.id DESC LIMIT ?'
+        )
+        rows = self.db.connect().execute(sql, params + [limit + 1]).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([sort, rows[-1]['sort_value'], rows[-1]['id']])
+        return [json.loads(row['data']) for row in rows], next_cursor
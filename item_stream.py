@@ -0,0 +1,62 @@
+import json
+
+
+class ItemStreamDecoder:
+    # Incrementally decodes a JSON array of objects as text arrives, e.g.
+    # '[{"item": "Fries", "price": 4.5}, {"item": ...' fed a few characters at
+    # a time. Each object is returned from feed() as soon as its closing brace
+    # has been seen. Only the text of the object currently being read is
+    # buffered, and anything before the opening '[' (such as a code fence or
+    # the '{"items":' wrapper of schema-constrained output) is skipped.
+
+    def __init__(self, loads=json.loads):
+        # `loads` turns the text of one object into the item to return;
+        # objects it returns None for are skipped
+        self._loads = loads
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer = []
+
+    @property
+    def done(self):
+        return self._done
+
+    def feed(self, text):
+        items = []
+        for ch in text:
+            if self._done:
+                break
+            if not self._in_array:
+                if ch == '[':
+                    self._in_array = True
+                continue
+            if self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+                    self._buffer = [ch]
+                elif ch == ']':
+                    self._done = True
+                continue
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    item = self._loads(''.join(self._buffer))
+                    if item is not None:
+                        items.append(item)
+                    self._buffer = []
+        return items
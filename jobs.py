@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished);
+'''
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    # Runs parses on a bounded thread pool so request threads can return as
+    # soon as the upload is saved. A job runs in the process that accepted
+    # it, but its status is kept in the shared database so a poll answered
+    # by any worker process finds it. Finished jobs are kept for
+    # `result_ttl` seconds so clients have time to poll for them.
+
+    def __init__(self, db, workers=4, max_pending=64, result_ttl=3600):
+        self.db = db
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='parse-job')
+        self._unfinished = set()
+        self._closed = False
+        self._lock = threading.Condition()
+        db.add_schema(SCHEMA)
+
+    def submit(self, fn, *args, **kwargs):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self._closed:
+                raise QueueFull('Shutting down')
+            if len(self._unfinished) >= self.max_pending:
+                raise QueueFull(f'{len(self._unfinished)} jobs already pending')
+            self._unfinished.add(job_id)
+        try:
+            self._prune()
+            now = time.time()
+            self._write(job_id, {'id': job_id, 'status': 'queued', 'created': now}, created=now)
+        except Exception:
+            with self._lock:
+                self._unfinished.discard(job_id)
+            raise
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    @property
+    def pending(self):
+        return len(self._unfinished)
+
+    def get(self, job_id):
+        row = self.db.connect().execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def _run(self, job_id, fn, args, kwargs):
+        job = {'id': job_id, 'status': 'running', 'started': time.time()}
+        try:
+            self._update(job_id, job)
+            job['result'] = fn(*args, **kwargs)
+        except Exception as e:
+            job.pop('result', None)
+            job.update(status='error', error=str(e))
+        else:
+            job['status'] = 'done'
+        finally:
+            job['finished'] = time.time()
+            try:
+                self._update(job_id, job)
+            finally:
+                with self._lock:
+                    self._unfinished.discard(job_id)
+                    self._lock.notify_all()
+
+    def _write(self, job_id, job, created):
+        self.db.connect().execute(
+            'INSERT INTO jobs (id, status, created, finished, data) VALUES (?, ?, ?, ?, ?)',
+            (job_id, job['status'], created, job.get('finished'), json.dumps(job)),
+        )
+
+    def _update(self, job_id, fields):
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            job = dict(json.loads(row['data']), **fields)
+            conn.execute(
+                'UPDATE jobs SET status = ?, finished = ?, data = ? WHERE id = ?',
+                (job['status'], job.get('finished'), json.dumps(job), job_id),
+            )
+
+    def _prune(self):
+        self.db.connect().execute('DELETE FROM jobs WHERE finished < ?', (time.time() - self.result_ttl,))
+
+    def drain(self, timeout=None):
+        # Stops accepting jobs and waits up to `timeout` seconds for the queued
+        # and running ones to finish. Jobs still unfinished after that are
+        # marked as failed, since no process will pick them up again. Returns
+        # how many there were.
+        with self._lock:
+            self._closed = True
+            self._lock.wait_for(lambda: not self._unfinished, timeout)
+            abandoned = list(self._unfinished)
+        for job_id in abandoned:
+            self._update(job_id, {'status': 'error', 'error': 'Server shut down before the parse finished',
+                                  'finished': time.time()})
+        return len(abandoned)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
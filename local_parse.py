@@ -0,0 +1,146 @@
+import importlib.util
+import io
+import re
+import threading
+
+from metrics import registry, Counter
+
+PARSE_TIER = registry.register(Counter(
+    'tabtogether_parse_tier_total', 'Receipts resolved at each tier of the parse cascade', ['tier']))
+
+PRICE = r'(?P<price>-?\$?\s?\d{1,5}[.,]\d{2})'
+ITEM_LINE = re.compile(r'^(?:(?P<qty>\d{1,2})\s*[xX@]?\s+)?(?P<name>.*?[A-Za-z].*?)\s+' + PRICE + r'\s*[A-Z]{0,2}$')
+SUBTOTAL_LINE = re.compile(r'\bsub\s*-?\s*total\b.*?' + PRICE, re.IGNORECASE)
+TAX_LINE = re.compile(r'\b(?:sales\s+)?tax\b.*?' + PRICE, re.IGNORECASE)
+TOTAL_LINE = re.compile(r'^\s*(?:grand\s+)?total\b.*?' + PRICE, re.IGNORECASE)
+NOT_AN_ITEM = re.compile(
+    r'\b(?:sub\s*-?\s*total|total|tax|tip|gratuity|change|cash|visa|mastercard|amex|discover|debit|credit|'
+    r'balance|amount\s+due|due|tender|payment|card|auth|approval|server|table|guests?)\b',
+    re.IGNORECASE,
+)
+
+
+def _price(text):
+    return float(text.replace('$', '').replace(' ', '').replace(',', '.'))
+
+
+def parse_lines(lines):
+    # Pulls line items and the printed subtotal/tax/total out of OCR text
+    items = []
+    printed = {}
+    for line in lines:
+        line = ' '.join(line.split())
+        if not line:
+            continue
+        for key, pattern in (('subtotal', SUBTOTAL_LINE), ('tax', TAX_LINE), ('total', TOTAL_LINE)):
+            match = pattern.search(line)
+            if match and key not in printed:
+                printed[key] = _price(match.group('price'))
+                break
+        if NOT_AN_ITEM.search(line):
+            continue
+        match = ITEM_LINE.match(line)
+        if match:
+            name, price = match.group('name').strip(' .:-'), _price(match.group('price'))
+            quantity = int(match.group('qty') or 1)
+            # The printed price is the line total; split it into a unit price
+            # only when that is exact, otherwise keep the count in the name
+            if quantity > 1 and round(round(price / quantity, 2) * quantity, 2) == price:
+                items.append({'item': name, 'price': round(price / quantity, 2), 'quantity': quantity})
+            elif quantity > 1:
+                items.append({'item': f'{quantity} {name}', 'price': price})
+            else:
+                items.append({'item': name, 'price': price})
+    return items, printed
+
+
+def score(items, printed, ocr_confidence):
+    # 0..1 confidence that `items` is the complete, correct item list. The
+    # strongest signal is the item sum matching the printed subtotal (or the
+    # total once tax is added back); OCR word confidence scales it down.
+    if not items:
+        return 0.0
+    item_sum = round(sum(item['price'] * item.get('quantity', 1) for item in items), 2)
+    if 'subtotal' in printed:
+        checks = abs(item_sum - printed['subtotal']) <= 0.01
+    elif 'total' in printed and 'tax' in printed:
+        checks = abs(item_sum + printed['tax'] - printed['total']) <= 0.01
+    elif 'total' in printed:
+        checks = abs(item_sum - printed['total']) <= 0.01
+    else:
+        return 0.3 * ocr_confidence
+    if not checks:
+        return 0.2 * ocr_confidence
+    return 0.5 + 0.5 * ocr_confidence
+
+
+class LocalParser:
+    # First tier of the parse cascade: OCR with Tesseract (the optional
+    # pytesseract package) followed by line-item regexes. Its result is used
+    # only when score() reaches `threshold`; otherwise the caller falls back
+    # to the model.
+
+    def __init__(self, enabled=True, threshold=0.9):
+        self.threshold = threshold
+        self.enabled = enabled and self._available()
+        self._counts = {'local': 0, 'model': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _available():
+        # Checked without importing, which is left to the first parse
+        return all(importlib.util.find_spec(name) is not None for name in ('pytesseract', 'PIL'))
+
+    @property
+    def signature(self):
+        return f'local:{self.threshold}' if self.enabled else 'nolocal'
+
+    def extract_lines(self, image_bytes):
+        import pytesseract
+        from PIL import Image
+
+        data = pytesseract.image_to_data(Image.open(io.BytesIO(image_bytes)), output_type=pytesseract.Output.DICT)
+        lines = {}
+        confidences = []
+        for i, word in enumerate(data['text']):
+            if not word.strip():
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(key, []).append(word)
+            conf = float(data['conf'][i])
+            if conf >= 0:
+                confidences.append(conf / 100)
+        ocr_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        return [' '.join(words) for _, words in sorted(lines.items())], ocr_confidence
+
+    def parse(self, image_bytes):
+        # Returns (items, confidence); items is None when the model is needed
+        if not self.enabled:
+            return None, 0.0
+        try:
+            lines, ocr_confidence = self.extract_lines(image_bytes)
+        except Exception:
+            return None, 0.0
+        items, printed = parse_lines(lines)
+        confidence = score(items, printed, ocr_confidence)
+        if confidence < self.threshold:
+            return None, confidence
+        for item in items:
+            item['ocrConfidence'] = round(confidence, 3)
+        return items, confidence
+
+    def record(self, tier):
+        PARSE_TIER.inc(tier=tier)
+        with self._lock:
+            self._counts[tier] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            'enabled': self.enabled,
+            'threshold': self.threshold,
+            'resolved': counts,
+            'share': {tier: round(count / total, 4) if total else 0.0 for tier, count in counts.items()},
+        }
@@ -0,0 +1,308 @@
+import http.client
+import json
+import math
+import random
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ModelClientError(Exception):
+    status_code = 502
+
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(ModelClientError):
+    status_code = 503
+
+    def __init__(self, retry_after):
+        super().__init__(f'Model provider is unavailable, retry in {math.ceil(retry_after)}s', retry_after=retry_after)
+
+
+class PoolExhaustedError(ModelClientError):
+    # Every pooled connection stayed busy for the whole wait. That is local
+    # saturation rather than a provider failure, so it is neither retried
+    # nor counted against the circuit breaker.
+    status_code = 503
+
+    def __init__(self, retry_after):
+        super().__init__('Timed out waiting for a pooled model connection', retry_after=retry_after)
+
+
+class ConnectionPool:
+    # Keep-alive HTTP/1.1 connections to a single host. Connections are only
+    # returned to the pool after their response has been read completely.
+
+    def __init__(self, base_url, max_size=10, connect_timeout=5.0, read_timeout=60.0):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.max_size = max_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._ssl_context = ssl.create_default_context() if parts.scheme == 'https' else None
+        self._stats = {'created': 0, 'reused': 0, 'discarded': 0, 'in_use': 0}
+
+    def acquire(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout if timeout is not None else self.read_timeout):
+            raise PoolExhaustedError(retry_after=1.0)
+        with self._lock:
+            self._stats['in_use'] += 1
+            if self._idle:
+                self._stats['reused'] += 1
+                conn = self._idle.pop()
+                conn.reused = True
+                return conn
+            self._stats['created'] += 1
+        try:
+            conn = self._connect()
+            conn.reused = False
+            return conn
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def release(self, conn, reusable=True):
+        with self._lock:
+            if reusable and len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                conn = None
+            else:
+                self._stats['discarded'] += 1
+        if conn is not None:
+            conn.close()
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._lock:
+            self._stats['in_use'] -= 1
+        self._slots.release()
+
+    def _connect(self):
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle), max_size=self.max_size)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures and rejects calls
+    # for `reset_timeout` seconds. After that a single trial call is let
+    # through (half-open); its outcome closes or re-opens the circuit.
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._opens = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(remaining)
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(self.reset_timeout)
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_skipped(self):
+        # The call never reached the provider; a half-open trial slot it held
+        # is handed to the next caller
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._opens += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {'state': self._state, 'consecutive_failures': self._failures, 'opens': self._opens}
+
+
+class ModelClient:
+    # OpenAI-compatible chat completions client with a persistent connection
+    # pool, per-call timeouts, jittered exponential backoff for retryable
+    # errors only, and a circuit breaker in front of the provider.
+
+    def __init__(self, base_url, api_key=None, pool=None, breaker=None, max_attempts=3, backoff_base=0.5, backoff_max=8.0):
+        self.base_url = base_url.rstrip('/')
+        self.path_prefix = urlsplit(self.base_url).path
+        self.api_key = api_key
+        self.pool = pool or ConnectionPool(self.base_url)
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    def chat(self, payload):
+        body = self._with_retries(lambda: self._request('/chat/completions', payload))
+        return json.loads(body)
+
+    def chat_stream(self, payload):
+        # Yields content deltas. Retries only happen before the first delta
+        # has been handed to the caller.
+        payload = dict(payload, stream=True)
+        conn, response = self._with_retries(lambda: self._request('/chat/completions', payload, stream=True))
+        reusable = False
+        try:
+            for line in response:
+                line = line.strip()
+                if not line.startswith(b'data:'):
+                    continue
+                data = line[5:].strip()
+                if data == b'[DONE]':
+                    reusable = True
+                    break
+                choices = json.loads(data).get('choices') or []
+                if choices and choices[0].get('delta', {}).get('content'):
+                    yield choices[0]['delta']['content']
+            if reusable:
+                response.read()
+                reusable = not response.will_close
+        except (OSError, http.client.HTTPException) as e:
+            self.breaker.record_failure()
+            raise ModelClientError(f'Model stream interrupted: {e}', retryable=True)
+        finally:
+            self.pool.release(conn, reusable=reusable)
+
+    def warm_up(self):
+        # Opens one pooled connection (TCP and TLS handshakes) so the first
+        # parse does not pay for it. Failures are left for that parse to report.
+        try:
+            self.pool.release(self.pool.acquire(timeout=self.pool.connect_timeout))
+        except (OSError, ModelClientError):
+            pass
+
+    def stats(self):
+        with self._lock:
+            retries = self._retries
+        return {'pool': self.pool.stats(), 'breaker': self.breaker.stats(), 'retries': retries}
+
+    def _with_retries(self, call):
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            try:
+                result = call()
+            except PoolExhaustedError:
+                self.breaker.record_skipped()
+                raise
+            except ModelClientError as e:
+                if e.retryable or (e.status is not None and e.status >= 500):
+                    self.breaker.record_failure()
+                else:
+                    # The provider answered; a 4xx is our request's fault
+                    self.breaker.record_success()
+                if not e.retryable or attempt >= self.max_attempts:
+                    raise
+                with self._lock:
+                    self._retries += 1
+                time.sleep(self._backoff(attempt, e.retry_after))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # Full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def _request(self, path, payload, stream=False):
+        headers = {'Content-Type': 'application/json', 'Accept': 'text/event-stream' if stream else 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+        body = json.dumps(payload).encode()
+        while True:
+            try:
+                conn = self.pool.acquire()
+            except OSError as e:
+                raise ModelClientError(f'Model connection failed: {e}', retryable=True)
+            try:
+                conn.request('POST', self.path_prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self.pool.release(conn, reusable=False)
+                if conn.reused and not isinstance(e, socket.timeout):
+                    # The server closed an idle keep-alive connection; try
+                    # again on another one without counting it as a failure
+                    continue
+                message = 'Model request timed out' if isinstance(e, socket.timeout) else f'Model connection failed: {e}'
+                raise ModelClientError(message, retryable=True)
+        if response.status >= 400:
+            error_body = response.read()
+            self.pool.release(conn, reusable=not response.will_close)
+            raise ModelClientError(
+                f'Model provider returned {response.status}: {error_body[:200].decode(errors="replace")}',
+                status=response.status,
+                retryable=response.status in RETRYABLE_STATUSES,
+                retry_after=_retry_after(response.getheader('Retry-After')),
+            )
+        if stream:
+            return conn, response
+        try:
+            response_body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.pool.release(conn, reusable=False)
+            raise ModelClientError(f'Model response interrupted: {e}', retryable=True)
+        self.pool.release(conn, reusable=not response.will_close)
+        return response_body
+
+
+def _retry_after(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(image_hash, model, prompt_version):
+    return hashlib.sha256(f'{image_hash}:{model}:{prompt_version}'.encode()).hexdigest()
+
+
+class ParseCache:
+    # Two tiers: a bounded in-memory LRU in front of an optional directory of
+    # JSON files. Disk entries expire after `ttl` seconds and the oldest are
+    # evicted once the directory grows past `max_bytes`.
+
+    def __init__(self, max_entries=256, disk_dir=None, ttl=7 * 24 * 3600, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._saved_seconds = 0.0
+        self._miss_seconds = 0.0
+        self._disk_bytes = None
+        self._last_sweep = 0.0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                self._credit_hit()
+                return entry
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._credit_hit()
+            self._memory_put(key, entry)
+        return entry
+
+    def put(self, key, items, elapsed=None):
+        # `elapsed` is the model time the entry cost to produce; it is used to
+        # estimate how much latency later hits save.
+        with self._lock:
+            self._memory_put(key, items)
+            self._stats['stores'] += 1
+            if elapsed is not None:
+                self._miss_seconds += elapsed
+        if self.disk_dir:
+            self._disk_put(key, items)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['saved_model_seconds'] = round(self._saved_seconds, 3)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _credit_hit(self):
+        if self._stats['stores']:
+            self._saved_seconds += self._miss_seconds / self._stats['stores']
+
+    def _memory_put(self, key, items):
+        self._memory[key] = items
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.json')
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, items):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(items, f)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        # Only walk the directory when the running size estimate says we are
+        # over budget, or periodically so expired entries get cleaned up.
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += size
+            sweep = (self._disk_bytes is None or self._disk_bytes > self.max_bytes
+                     or time.time() - self._last_sweep > min(self.ttl, 3600))
+        if sweep:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        now = time.time()
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.ttl:
+                    self._remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+            self._last_sweep = now
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._stats['evictions'] += 1
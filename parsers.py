@@ -0,0 +1,217 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from decoding import ITEMS_SCHEMA
+from model_client import CircuitBreaker, ConnectionPool, ModelClient
+
+# Bump whenever the prompt changes so cached parses from the old prompt are not reused
+PROMPT_VERSION = 2
+SYSTEM_PROMPT = "You are a helpful assistant that extracts items and prices from receipts."
+USER_PROMPT = (
+    "Please extract all items and prices from this receipt and return them as JSON: "
+    '{"items": [{"item": name, "price": unit price as a number, "quantity": count}]}. '
+    "Return only the JSON."
+)
+
+
+class ParserBackend:
+    # A backend turns receipt image bytes into the model's raw text answer.
+    # Decoding that text into items is left to the caller so it is the same
+    # for every backend.
+    name = None
+    model = None
+
+    def complete(self, image_bytes):
+        raise NotImplementedError
+
+    def stream(self, image_bytes):
+        # Yields the answer as text chunks; backends without streaming
+        # support produce it in one piece.
+        yield self.complete(image_bytes)
+
+    def stats(self):
+        return {}
+
+    def warm_up(self):
+        pass
+
+    @property
+    def max_concurrency(self):
+        # How many calls the backend can have in flight at once, or None if unbounded
+        return None
+
+
+class OpenAIBackend(ParserBackend):
+    # Talks to the chat completions API through model_client.ModelClient,
+    # which owns connection reuse, timeouts, retries and the circuit breaker.
+    name = 'openai'
+
+    def __init__(self, model="gpt-4o-mini", api_key=None, base_url=None, client=None, structured_output=True):
+        self.model = model
+        # Schema-constrained output; turn off for OpenAI-compatible servers
+        # that reject response_format
+        self.structured_output = structured_output
+        self.client = client or ModelClient(
+            base_url or os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1'),
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+        )
+
+    def complete(self, image_bytes):
+        response = self.client.chat(self._payload(image_bytes))
+        return response['choices'][0]['message']['content']
+
+    def stream(self, image_bytes):
+        return self.client.chat_stream(self._payload(image_bytes))
+
+    def stats(self):
+        return self.client.stats()
+
+    def warm_up(self):
+        self.client.warm_up()
+
+    @property
+    def max_concurrency(self):
+        # A call holds a pooled connection for its whole duration
+        return self.client.pool.max_size
+
+    def _payload(self, image_bytes):
+        image_url = f"data:{_mime_type(image_bytes)};base64,{base64.b64encode(image_bytes).decode()}"
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": [
+                    {"type": "text", "text": USER_PROMPT},
+                    {"type": "image_url", "image_url": {"url": image_url}},
+                ]},
+            ],
+        }
+        if self.structured_output:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "receipt_items", "strict": True, "schema": ITEMS_SCHEMA},
+            }
+        return payload
+
+
+def _mime_type(image_bytes):
+    if image_bytes.startswith(b'\x89PNG'):
+        return 'image/png'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+class FakeParserError(Exception):
+    pass
+
+
+MENU = [
+    ("Burger", 12.99), ("Cheeseburger", 13.99), ("Fries", 4.50), ("Onion Rings", 5.25),
+    ("Caesar Salad", 9.75), ("Margherita Pizza", 15.00), ("Pad Thai", 14.25), ("Ramen", 13.50),
+    ("Fish Tacos", 11.95), ("Chicken Wings", 10.99), ("Nachos", 8.75), ("Soda", 2.99),
+    ("Iced Tea", 3.25), ("Lemonade", 3.50), ("IPA Draft", 7.00), ("House Red", 9.00),
+    ("Espresso", 3.00), ("Cheesecake", 7.50), ("Brownie Sundae", 8.25), ("Side Salad", 4.95),
+]
+
+
+class FakeBackend(ParserBackend):
+    # Local stand-in for benchmarking and load tests. The item list is derived
+    # from the image hash, so the same image always parses the same way;
+    # latency and failures come from a seeded RNG so a run is repeatable.
+    name = 'fake'
+    model = 'fake'
+
+    def __init__(self, latency=0.8, jitter=0.3, failure_rate=0.0, seed=0, min_items=2, max_items=12):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.min_items = min_items
+        self.max_items = max_items
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def complete(self, image_bytes):
+        delay, fail = self._draw()
+        time.sleep(delay)
+        if fail:
+            raise FakeParserError('Simulated model failure')
+        return json.dumps(self.items_for(image_bytes))
+
+    def stream(self, image_bytes, chunk_size=8):
+        # Spreads the same total latency over the chunks, like a token stream
+        delay, fail = self._draw()
+        if fail:
+            time.sleep(delay)
+            raise FakeParserError('Simulated model failure')
+        text = json.dumps(self.items_for(image_bytes))
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            yield chunk
+
+    def _draw(self):
+        with self._lock:
+            delay = max(0.0, self._rng.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+            fail = self._rng.random() < self.failure_rate
+        return delay, fail
+
+    def items_for(self, image_bytes):
+        rng = random.Random(hashlib.sha256(image_bytes).digest())
+        count = rng.randint(self.min_items, self.max_items)
+        return [{"item": name, "price": price} for name, price in rng.choices(MENU, k=count)]
+
+
+BACKENDS = {
+    OpenAIBackend.name: OpenAIBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+
+def create_backend(name, **options):
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f'Unknown parser backend {name!r}, expected one of {sorted(BACKENDS)}')
+    return backend_cls(**options)
+
+
+def backend_from_env():
+    name = os.getenv('PARSER_BACKEND', 'openai')
+    if name == FakeBackend.name:
+        return create_backend(
+            name,
+            latency=float(os.getenv('FAKE_PARSER_LATENCY', 0.8)),
+            jitter=float(os.getenv('FAKE_PARSER_JITTER', 0.3)),
+            failure_rate=float(os.getenv('FAKE_PARSER_FAILURE_RATE', 0.0)),
+            seed=int(os.getenv('FAKE_PARSER_SEED', 0)),
+        )
+    if name == OpenAIBackend.name:
+        base_url = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+        client = ModelClient(
+            base_url,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            pool=ConnectionPool(
+                base_url,
+                max_size=int(os.getenv('MODEL_POOL_SIZE', 10)),
+                connect_timeout=float(os.getenv('MODEL_CONNECT_TIMEOUT', 5)),
+                read_timeout=float(os.getenv('MODEL_READ_TIMEOUT', 60)),
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv('MODEL_BREAKER_THRESHOLD', 5)),
+                reset_timeout=float(os.getenv('MODEL_BREAKER_RESET', 30)),
+            ),
+            max_attempts=int(os.getenv('MODEL_MAX_ATTEMPTS', 3)),
+        )
+        return create_backend(
+            name,
+            model=os.getenv('OPENAI_MODEL', "gpt-4o-mini"),
+            client=client,
+            structured_output=os.getenv('MODEL_STRUCTURED_OUTPUT', '1') != '0',
+        )
+    return create_backend(name)
@@ -0,0 +1,108 @@
+import importlib.util
+import io
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import registry, Counter, Histogram, BYTES_BUCKETS
+
+# Pillow is imported by the first preprocessing run, not at startup. Without
+# it preprocessing is skipped and the original bytes are sent.
+HAVE_PIL = importlib.util.find_spec('PIL') is not None
+
+PREPROCESS_BYTES = registry.register(Histogram(
+    'tabtogether_preprocess_bytes', 'Image size before and after preprocessing', ['phase'], buckets=BYTES_BUCKETS))
+PREPROCESS_RESULTS = registry.register(Counter(
+    'tabtogether_preprocess_total', 'Preprocessing runs, by outcome', ['outcome']))
+
+
+def receipt_box(image):
+    # Receipts are bright paper on a darker table: threshold a blurred,
+    # downscaled grayscale copy and take the bounding box of the bright
+    # region, with a small margin. Returns None when the box is implausibly
+    # small or covers almost the whole photo.
+    from PIL import ImageFilter, ImageOps
+
+    small = image.convert('L')
+    small.thumbnail((400, 400))
+    scale = image.width / small.width
+    mask = ImageOps.autocontrast(small).filter(ImageFilter.GaussianBlur(3)).point(lambda v: 255 if v > 170 else 0)
+    box = mask.getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    area = (right - left) * (bottom - top)
+    if area < 0.15 * small.width * small.height or area > 0.95 * small.width * small.height:
+        return None
+    margin = 0.02 * max(small.width, small.height)
+    return (
+        max(0, int((left - margin) * scale)),
+        max(0, int((top - margin) * scale)),
+        min(image.width, int((right + margin) * scale)),
+        min(image.height, int((bottom + margin) * scale)),
+    )
+
+
+def preprocess_image(image_bytes, max_dim=1600, quality=80, grayscale=True, crop=True):
+    # Module-level so it can run in a process pool. Returns JPEG bytes, or
+    # None when the input cannot be decoded.
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image = ImageOps.exif_transpose(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    image = image.convert('L') if grayscale else image.convert('RGB')
+    box = receipt_box(image) if crop else None
+    if box is not None:
+        image = image.crop(box)
+    image.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+class Preprocessor:
+    # Shrinks receipt photos before they are sent to the parser: EXIF
+    # orientation, crop to the paper, grayscale, downscale to `max_dim` and
+    # JPEG recompression. Work runs on a thread or process pool; when Pillow is
+    # missing, the image cannot be decoded, or the result would be larger, the
+    # original bytes are passed through unchanged.
+
+    def __init__(self, enabled=True, max_dim=1600, quality=80, grayscale=True, crop=True, workers=2, executor='thread'):
+        self.enabled = enabled and HAVE_PIL
+        self.options = {'max_dim': max_dim, 'quality': quality, 'grayscale': grayscale, 'crop': crop}
+        self._executor = None
+        if self.enabled:
+            pool = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+            self._executor = pool(max_workers=workers)
+
+    @property
+    def signature(self):
+        # Part of the parse cache key, since different settings send the model different images
+        if not self.enabled:
+            return 'raw'
+        return 'prep:{max_dim}:{quality}:{grayscale:d}:{crop:d}'.format(**self.options)
+
+    def warm_up(self):
+        # Imports Pillow in the worker (and starts it, for a process pool)
+        # ahead of the first upload
+        if self.enabled:
+            self._executor.submit(preprocess_image, b'', **self.options).result()
+
+    def run(self, image_bytes):
+        PREPROCESS_BYTES.observe(len(image_bytes), phase='before')
+        if not self.enabled:
+            PREPROCESS_RESULTS.inc(outcome='disabled')
+            PREPROCESS_BYTES.observe(len(image_bytes), phase='after')
+            return image_bytes
+        processed = self._executor.submit(preprocess_image, image_bytes, **self.options).result()
+        if processed is None:
+            PREPROCESS_RESULTS.inc(outcome='undecodable')
+            processed = image_bytes
+        elif len(processed) >= len(image_bytes):
+            PREPROCESS_RESULTS.inc(outcome='not_smaller')
+            processed = image_bytes
+        else:
+            PREPROCESS_RESULTS.inc(outcome='shrunk')
+        PREPROCESS_BYTES.observe(len(processed), phase='after')
+        return processed
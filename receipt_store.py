@@ -0,0 +1,117 @@
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS receipts (
+    id TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_receipts_timestamp ON receipts(timestamp);
+'''
+
+
+def new_receipt(parsed_items, image_path):
+    # Mirrors the Receipt/Item interfaces in TabTogetherFrontend/types/Bill.ts
+    items = [{
+        'id': uuid.uuid4().hex,
+        'name': item.get('item', ''),
+        'price': item.get('price', 0),
+        'quantity': item.get('quantity', 1),
+        'assignedTo': [],
+        'isSharedEqually': False,
+        'ocrConfidence': item.get('ocrConfidence', 0),
+    } for item in parsed_items]
+    return {
+        'id': uuid.uuid4().hex,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'imageUrl': '',
+        'originalImagePath': image_path,
+        'totalAmount': round(sum(item['price'] * item['quantity'] for item in items), 2),
+        'taxAmount': 0,
+        'tipAmount': 0,
+        'detectedTip': 0,
+        'manualTip': 0,
+        'items': items,
+        'participants': [],
+        'splitMethod': 'equal',
+        'isProcessed': True,
+        'ocrConfidence': 0,
+    }
+
+
+class ReceiptStore:
+    # Receipts live in SQLite so every worker process sees the same data; a
+    # small per-process LRU sits in front for repeated reads of hot receipts.
+    # Every write bumps the row's version, and a cached receipt is only
+    # served while its version still matches, so an edit made through
+    # another worker is seen straight away. Checking the version is a
+    # primary-key lookup of one integer, which is much cheaper than reading
+    # and decoding the receipt.
+
+    def __init__(self, db, cache_size=128):
+        self.db = db
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        db.add_schema(SCHEMA)
+
+    def save(self, receipt):
+        timestamp = datetime.fromisoformat(receipt['timestamp']).timestamp()
+        with self.db.transaction() as conn:
+            conn.execute(
+                'INSERT INTO receipts (id, timestamp, data) VALUES (?, ?, ?)'
+                ' ON CONFLICT (id) DO UPDATE SET timestamp = excluded.timestamp, data = excluded.data,'
+                ' version = version + 1',
+                (receipt['id'], timestamp, json.dumps(receipt)),
+            )
+            version = conn.execute('SELECT version FROM receipts WHERE id = ?', (receipt['id'],)).fetchone()['version']
+        self._cache_put(receipt, version)
+        return receipt
+
+    def get(self, receipt_id):
+        conn = self.db.connect()
+        with self._lock:
+            entry = self._cache.get(receipt_id)
+        if entry is not None:
+            row = conn.execute('SELECT version FROM receipts WHERE id = ?', (receipt_id,)).fetchone()
+            if row is None:
+                return None
+            if row['version'] == entry[0]:
+                with self._lock:
+                    if receipt_id in self._cache:
+                        self._cache.move_to_end(receipt_id)
+                return entry[1]
+        row = conn.execute('SELECT data, version FROM receipts WHERE id = ?', (receipt_id,)).fetchone()
+        if row is None:
+            return None
+        receipt = json.loads(row['data'])
+        self._cache_put(receipt, row['version'])
+        return receipt
+
+    def update(self, receipt_id, fn):
+        # Read-modify-write under the database write lock so concurrent edits
+        # from other threads or processes are never lost. `fn` mutates the
+        # receipt in place; its return value is passed back to the caller.
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT data, version FROM receipts WHERE id = ?', (receipt_id,)).fetchone()
+            if row is None:
+                return None, None
+            receipt = json.loads(row['data'])
+            result = fn(receipt)
+            version = row['version'] + 1
+            conn.execute('UPDATE receipts SET data = ?, version = ? WHERE id = ?',
+                         (json.dumps(receipt), version, receipt_id))
+        self._cache_put(receipt, version)
+        return receipt, result
+
+    def _cache_put(self, receipt, version):
+        with self._lock:
+            self._cache[receipt['id']] = (version, receipt)
+            self._cache.move_to_end(receipt['id'])
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
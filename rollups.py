@@ -0,0 +1,163 @@
+import json
+from datetime import datetime, timezone
+
+from split_engine import to_cents
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rollup_user (
+    user_id TEXT PRIMARY KEY,
+    bill_count INTEGER NOT NULL,
+    total_cents INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollup_month (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    bill_count INTEGER NOT NULL,
+    total_cents INTEGER NOT NULL,
+    PRIMARY KEY (user_id, month)
+);
+CREATE TABLE IF NOT EXISTS rollup_venue (
+    user_id TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    bill_count INTEGER NOT NULL,
+    total_cents INTEGER NOT NULL,
+    PRIMARY KEY (user_id, venue)
+);
+CREATE TABLE IF NOT EXISTS rollup_participant (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    bill_count INTEGER NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_rollup_participant_count ON rollup_participant(user_id, bill_count);
+CREATE INDEX IF NOT EXISTS idx_rollup_participant_seen ON rollup_participant(user_id, last_seen);
+CREATE TABLE IF NOT EXISTS bill_participants (
+    seq INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    date REAL NOT NULL,
+    PRIMARY KEY (seq, name)
+);
+CREATE INDEX IF NOT EXISTS idx_bill_participants_name ON bill_participants(user_id, name, date);
+'''
+
+ROLLUP_TABLES = ('rollup_user', 'rollup_month', 'rollup_venue', 'rollup_participant', 'bill_participants')
+
+
+def month_of(timestamp):
+    # Months are bucketed in UTC
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m')
+
+
+def participant_names(bill):
+    return sorted({p['name'] for p in bill['receipt'].get('participants', []) if p.get('name')})
+
+
+def add_bill(conn, seq, user_id, date, bill):
+    # Counts one bill into every rollup. Runs inside the caller's transaction
+    # so the rollups can never disagree with the bills table.
+    cents = to_cents(bill['totalAmount'])
+    for table, key_column, key in (
+        ('rollup_user', None, None),
+        ('rollup_month', 'month', month_of(date)),
+        ('rollup_venue', 'venue', bill['venue']),
+    ):
+        columns, values = ('user_id',), (user_id,)
+        if key_column:
+            columns, values = columns + (key_column,), values + (key,)
+        conn.execute(
+            f'INSERT INTO {table} ({", ".join(columns)}, bill_count, total_cents)'
+            f' VALUES ({", ".join("?" * len(columns))}, 1, ?)'
+            f' ON CONFLICT ({", ".join(columns)}) DO UPDATE SET'
+            ' bill_count = bill_count + 1, total_cents = total_cents + excluded.total_cents',
+            values + (cents,),
+        )
+    for name in participant_names(bill):
+        conn.execute('INSERT INTO bill_participants (seq, user_id, name, date) VALUES (?, ?, ?, ?)', (seq, user_id, name, date))
+        conn.execute(
+            'INSERT INTO rollup_participant (user_id, name, bill_count, last_seen) VALUES (?, ?, 1, ?)'
+            ' ON CONFLICT (user_id, name) DO UPDATE SET bill_count = bill_count + 1, last_seen = max(last_seen, excluded.last_seen)',
+            (user_id, name, date),
+        )
+
+
+def remove_bill(conn, seq, user_id, date, bill):
+    # Inverse of add_bill. Rows that drop to zero bills are deleted so that
+    # venues and participants from deleted bills disappear from the stats.
+    cents = to_cents(bill['totalAmount'])
+    for table, key_column, key in (
+        ('rollup_user', None, None),
+        ('rollup_month', 'month', month_of(date)),
+        ('rollup_venue', 'venue', bill['venue']),
+    ):
+        where, values = 'user_id = ?', (user_id,)
+        if key_column:
+            where, values = f'{where} AND {key_column} = ?', values + (key,)
+        conn.execute(
+            f'UPDATE {table} SET bill_count = bill_count - 1, total_cents = total_cents - ? WHERE {where}', (cents,) + values)
+        conn.execute(f'DELETE FROM {table} WHERE {where} AND bill_count <= 0', values)
+    for name in participant_names(bill):
+        conn.execute('DELETE FROM bill_participants WHERE seq = ? AND name = ?', (seq, name))
+        # The participant's previous appearance, if this was their latest bill
+        last = conn.execute(
+            'SELECT max(date) AS last_seen FROM bill_participants WHERE user_id = ? AND name = ?', (user_id, name),
+        ).fetchone()['last_seen']
+        if last is None:
+            conn.execute('DELETE FROM rollup_participant WHERE user_id = ? AND name = ?', (user_id, name))
+        else:
+            conn.execute(
+                'UPDATE rollup_participant SET bill_count = bill_count - 1, last_seen = ? WHERE user_id = ? AND name = ?',
+                (last, user_id, name),
+            )
+
+
+def rebuild(conn):
+    # Recomputes every rollup from the bills table. Runs in the caller's
+    # transaction; returns the number of bills counted.
+    for table in ROLLUP_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+    count = 0
+    for row in conn.execute('SELECT seq, user_id, date, data FROM bills').fetchall():
+        add_bill(conn, row['seq'], row['user_id'], row['date'], json.loads(row['data']))
+        count += 1
+    return count
+
+
+def stats(conn, user_id, month):
+    # Same fields as BillStorageService.getBillStats, from a fixed number of
+    # primary-key and index lookups
+    user = conn.execute('SELECT bill_count, total_cents FROM rollup_user WHERE user_id = ?', (user_id,)).fetchone()
+    this_month = conn.execute(
+        'SELECT total_cents FROM rollup_month WHERE user_id = ? AND month = ?', (user_id, month)).fetchone()
+    frequent = conn.execute(
+        'SELECT name FROM rollup_participant WHERE user_id = ? ORDER BY bill_count DESC LIMIT 1', (user_id,)).fetchone()
+    bill_count = user['bill_count'] if user else 0
+    total_cents = user['total_cents'] if user else 0
+    return {
+        'totalBills': bill_count,
+        'totalAmount': total_cents / 100,
+        'averageAmount': round(total_cents / bill_count / 100, 2) if bill_count else 0,
+        'mostFrequentParticipant': frequent['name'] if frequent else None,
+        'thisMonthTotal': this_month['total_cents'] / 100 if this_month else 0,
+        'month': month,
+    }
+
+
+def recent_participants(conn, user_id, since, limit=10):
+    rows = conn.execute(
+        'SELECT name FROM rollup_participant WHERE user_id = ? AND last_seen >= ? ORDER BY last_seen DESC LIMIT ?',
+        (user_id, since, limit),
+    ).fetchall()
+    return [row['name'] for row in rows]
+
+
+def breakdown(conn, table, user_id, limit=12):
+    # Most recent months, or the biggest venues, first
+    key_column = {'rollup_month': 'month', 'rollup_venue': 'venue'}[table]
+    order = 'month DESC' if table == 'rollup_month' else 'total_cents DESC'
+    rows = conn.execute(
+        f'SELECT {key_column} AS key, bill_count, total_cents FROM {table} WHERE user_id = ? ORDER BY {order} LIMIT ?',
+        (user_id, limit),
+    ).fetchall()
+    return [{key_column: row['key'], 'bills': row['bill_count'], 'total': row['total_cents'] / 100} for row in rows]
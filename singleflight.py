@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import registry, Counter
+
+try:
+    import fcntl
+except ImportError:  # no cross-process leases on this platform
+    fcntl = None
+
+COALESCED = registry.register(Counter(
+    'tabtogether_singleflight_calls_total', 'Parses by whether they ran or waited on an identical one', ['role']))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key into one: the first caller
+    # runs `fn`, later callers in the same process block until it finishes and
+    # share its result or exception.
+    #
+    # With `lease_dir` set, the leader also takes an exclusive flock on
+    # <lease_dir>/<key>.lock, so leaders in other worker processes queue up
+    # behind it. Once a leader holds the lease it calls `recheck()` first, so
+    # a result another process just stored (e.g. in the on-disk parse cache)
+    # is picked up instead of being recomputed.
+
+    def __init__(self, lease_dir=None, lease_timeout=120.0):
+        self.lease_dir = lease_dir if fcntl is not None else None
+        self.lease_timeout = lease_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        if self.lease_dir:
+            os.makedirs(self.lease_dir, exist_ok=True)
+
+    def do(self, key, fn, recheck=None):
+        # Returns (led, result): led is False when the caller only waited for
+        # another caller's result
+        call, led = self.begin(key)
+        if not led:
+            return False, self.result(call)
+        try:
+            with self._lease(key):
+                result = recheck() if recheck is not None and self.lease_dir else None
+                result = result if result is not None else fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return True, result
+
+    def begin(self, key):
+        # For leaders that produce their result piecemeal (a streamed parse)
+        # and so cannot hand do() a function. Returns (call, led); a leader
+        # must pass the call to finish(), a follower gets the leader's result
+        # from result(call). No cross-process lease is taken.
+        with self._lock:
+            call = self._calls.get(key)
+            led = call is None
+            if led:
+                call = self._calls[key] = _Call()
+        COALESCED.inc(role='leader' if led else 'follower')
+        return call, led
+
+    def finish(self, key, call, result=None, error=None):
+        call.result = result
+        call.error = error
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    def result(self, call):
+        return self._wait(call)
+
+    def wait(self, key):
+        # Returns (True, result) after waiting for an in-flight call for
+        # `key`, or (False, None) when there is none.
+        with self._lock:
+            call = self._calls.get(key)
+        if call is None:
+            return False, None
+        COALESCED.inc(role='follower')
+        return True, self._wait(call)
+
+    def _wait(self, call):
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    @contextmanager
+    def _lease(self, key):
+        if not self.lease_dir:
+            yield
+            return
+        with open(os.path.join(self.lease_dir, key + '.lock'), 'a') as lock_file:
+            deadline = time.monotonic() + self.lease_timeout
+            locked = False
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except BlockingIOError:
+                    # A leader that has held the lease this long is assumed
+                    # stuck; go ahead without it rather than wait forever
+                    if time.monotonic() >= deadline:
+                        break
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
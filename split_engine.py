@@ -0,0 +1,308 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+_numpy = None
+
+
+def numpy_module():
+    # numpy is imported on first use rather than at startup, since it is the
+    # slowest import in the service. Returns None when it is not installed;
+    # the pure-Python path gives identical results, just slower for big tables.
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def to_cents(amount):
+    return int(Decimal(str(amount)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents):
+    return cents / 100
+
+
+def allocate(total, weights):
+    # Largest-remainder apportionment of `total` cents in proportion to
+    # `weights`, using integer arithmetic only so the parts always sum to
+    # `total`. Ties go to the earlier entry.
+    weights = [int(w) for w in weights]
+    if not weights:
+        return []
+    weight_sum = sum(weights)
+    if weight_sum == 0:
+        weights = [1] * len(weights)
+        weight_sum = len(weights)
+    parts = [total * w // weight_sum for w in weights]
+    leftover = total - sum(parts)
+    if leftover:
+        remainders = [total * w % weight_sum for w in weights]
+        order = sorted(range(len(weights)), key=lambda i: -remainders[i])
+        for i in order[:leftover]:
+            parts[i] += 1
+    return parts
+
+
+def _item_shares_numpy(holders, cents, participant_count):
+    # Builds a (participants, items) assignment matrix and divides every item
+    # evenly among its assignees at once; leftover cents go to the first
+    # `remainder` assignees of each item.
+    np = numpy_module()
+    cents = np.array(cents, dtype=np.int64)
+    assignment = np.zeros((participant_count, len(cents)), dtype=bool)
+    rows = [p for item_holders in holders for p in item_holders]
+    cols = [i for i, item_holders in enumerate(holders) for _ in item_holders]
+    assignment[rows, cols] = True
+    counts = assignment.sum(axis=0)
+    divisor = np.maximum(counts, 1)
+    base = cents // divisor
+    remainder = cents % divisor
+    rank = np.cumsum(assignment, axis=0) - 1
+    extra = assignment & (rank < remainder)
+    shares = assignment * base + extra
+    unassigned = int(cents[counts == 0].sum())
+    return shares.sum(axis=1).tolist(), unassigned
+
+
+def _item_shares_python(holders, cents, participant_count):
+    subtotals = [0] * participant_count
+    unassigned = 0
+    for item_holders, item_cents in zip(holders, cents):
+        if not item_holders:
+            unassigned += item_cents
+            continue
+        base, remainder = divmod(item_cents, len(item_holders))
+        for rank, p in enumerate(sorted(item_holders)):
+            subtotals[p] += base + (1 if rank < remainder else 0)
+    return subtotals, unassigned
+
+
+def item_subtotals(items, participant_ids):
+    # Returns each participant's item subtotal in cents plus the cents of
+    # items nobody is assigned to.
+    index = {pid: p for p, pid in enumerate(participant_ids)}
+    cents = [to_cents(item['price']) * int(item.get('quantity', 1)) for item in items]
+    everyone = list(range(len(participant_ids)))
+    holders = []
+    for i, item in enumerate(items):
+        if item.get('isSharedEqually'):
+            holders.append(everyone)
+            continue
+        item_holders = set()
+        for pid in item.get('assignedTo', []):
+            if pid not in index:
+                raise ValueError(f'Item {item.get("id", i)} is assigned to unknown participant {pid}')
+            item_holders.add(index[pid])
+        holders.append(sorted(item_holders))
+    if items and numpy_module() is not None:
+        return _item_shares_numpy(holders, cents, len(participant_ids))
+    return _item_shares_python(holders, cents, len(participant_ids))
+
+
+def _charge_cents(bill, subtotal_cents, amount_key, rate_key):
+    if bill.get(rate_key) is not None:
+        return int((Decimal(subtotal_cents) * Decimal(str(bill[rate_key])) / 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    if bill.get(amount_key) is not None:
+        return to_cents(bill[amount_key])
+    return 0
+
+
+def split_bill(bill):
+    # Splits one bill shaped like Receipt in types/Bill.ts: items carry
+    # `assignedTo` / `isSharedEqually`, tax and tip are given either as
+    # percentages (taxRate/tipPercentage, which win when present) or as
+    # amounts (taxAmount/tipAmount).
+    # Tax and tip are apportioned by each participant's item subtotal; the
+    # share belonging to unassigned items is reported separately so that the
+    # parts always add up to the bill total.
+    items = bill.get('items') or []
+    participants = bill.get('participants') or []
+    if not participants:
+        raise ValueError('At least one participant is required')
+    participant_ids = [p['id'] for p in participants]
+
+    subtotals, unassigned = item_subtotals(items, participant_ids)
+    subtotal = sum(subtotals) + unassigned
+    tax = _charge_cents(bill, subtotal, 'taxAmount', 'taxRate')
+    tip = _charge_cents(bill, subtotal, 'tipAmount', 'tipPercentage')
+
+    weights = subtotals + [unassigned]
+    tax_parts = allocate(tax, weights)
+    tip_parts = allocate(tip, weights)
+
+    summaries = [_summary(participant, subtotals[p], tax_parts[p], tip_parts[p])
+                 for p, participant in enumerate(participants)]
+    unassigned_total = unassigned + tax_parts[-1] + tip_parts[-1]
+    total = subtotal + tax + tip
+    calculated = sum(s['totalOwedCents'] for s in summaries) + unassigned_total
+    return {
+        'receiptId': bill.get('id'),
+        'participants': summaries,
+        'subtotal': from_cents(subtotal),
+        'tax': from_cents(tax),
+        'tip': from_cents(tip),
+        'unassignedTotal': from_cents(unassigned_total),
+        'totalVerification': {
+            'calculatedTotal': from_cents(calculated),
+            'originalTotal': from_cents(total),
+            'isAccurate': calculated == total,
+        },
+    }
+
+
+def split_bills(bills):
+    if not isinstance(bills, list) or not all(isinstance(bill, dict) for bill in bills):
+        raise ValueError('"bills" must be a list of bill objects')
+    return [split_bill(bill) for bill in bills]
+
+
+def _summary(participant, subtotal, tax, tip):
+    owed = subtotal + tax + tip
+    return {
+        'id': participant['id'],
+        'name': participant.get('name', ''),
+        'itemsTotal': from_cents(subtotal),
+        'taxOwed': from_cents(tax),
+        'tipOwed': from_cents(tip),
+        'totalOwed': from_cents(owed),
+        'totalOwedCents': owed,
+    }
+
+
+# Incremental re-splitting. A stored receipt keeps running per-participant
+# totals in `splitState`; an assignment change only re-divides the items it
+# touches, and tax/tip are re-apportioned from the running subtotals in
+# O(participants) without walking the items again.
+
+def build_split_state(bill):
+    participant_ids = [p['id'] for p in bill.get('participants') or []]
+    subtotals, unassigned = item_subtotals(bill.get('items') or [], participant_ids)
+    state = {
+        'subtotals': dict(zip(participant_ids, subtotals)),
+        'unassigned': unassigned,
+        'taxShares': {},
+        'tipShares': {},
+    }
+    _set_charges(bill, state)
+    _apportion(bill, state)
+    return state
+
+
+def _set_charges(bill, state):
+    subtotal = sum(state['subtotals'].values()) + state['unassigned']
+    state['tax'] = _charge_cents(bill, subtotal, 'taxAmount', 'taxRate')
+    state['tip'] = _charge_cents(bill, subtotal, 'tipAmount', 'tipPercentage')
+
+
+def _apportion(bill, state):
+    # Returns the ids whose tax or tip share moved
+    participant_ids = [p['id'] for p in bill.get('participants') or []]
+    weights = [state['subtotals'][pid] for pid in participant_ids] + [state['unassigned']]
+    changed = set()
+    for key, total in (('taxShares', state['tax']), ('tipShares', state['tip'])):
+        parts = allocate(total, weights)
+        for pid, part in zip(participant_ids, parts):
+            if state[key].get(pid) != part:
+                state[key][pid] = part
+                changed.add(pid)
+        state[key]['_unassigned'] = parts[-1]
+    return changed
+
+
+def _holders(item, order, index):
+    if item.get('isSharedEqually'):
+        return list(order)
+    return sorted(set(item.get('assignedTo', [])), key=index.__getitem__)
+
+
+def _move_item(item, old_holders, new_holders, state):
+    # Takes the item's cents back from its old holders and re-divides them
+    # among the new ones, with the same remainder rule as item_subtotals.
+    cents = to_cents(item['price']) * int(item.get('quantity', 1))
+    touched = set()
+    for holders, sign in ((old_holders, -1), (new_holders, 1)):
+        if not holders:
+            state['unassigned'] += sign * cents
+            continue
+        base, remainder = divmod(cents, len(holders))
+        for rank, pid in enumerate(holders):
+            state['subtotals'][pid] += sign * (base + (1 if rank < remainder else 0))
+            touched.add(pid)
+    return touched
+
+
+def apply_split_delta(bill, state, delta):
+    # Applies `delta` to `bill` and `state` in place and returns summaries
+    # for the participants whose shares changed. Supported changes:
+    #   {"op": "assign" | "unassign", "itemId": ..., "participantId": ...}
+    #   {"op": "addParticipant", "participant": {"id": ..., "name": ...}}
+    # plus optional top-level taxAmount/taxRate/tipAmount/tipPercentage.
+    participants = bill.setdefault('participants', [])
+    order = [p['id'] for p in participants]
+    index = {pid: p for p, pid in enumerate(order)}
+    items = {item['id']: item for item in bill.get('items') or []}
+    touched = set()
+
+    for change in delta.get('changes', []):
+        op = change.get('op')
+        if op == 'addParticipant':
+            participant = dict(change['participant'])
+            if participant['id'] in state['subtotals']:
+                raise ValueError(f'Participant {participant["id"]} already exists')
+            shared = [item for item in items.values() if item.get('isSharedEqually')]
+            old = {item['id']: _holders(item, order, index) for item in shared}
+            participant.setdefault('assignedItems', [])
+            participants.append(participant)
+            index[participant['id']] = len(order)
+            order.append(participant['id'])
+            state['subtotals'][participant['id']] = 0
+            touched.add(participant['id'])
+            for item in shared:
+                touched |= _move_item(item, old[item['id']], _holders(item, order, index), state)
+        elif op in ('assign', 'unassign'):
+            item = items.get(change.get('itemId'))
+            pid = change.get('participantId')
+            if item is None:
+                raise ValueError(f'Unknown item {change.get("itemId")}')
+            if pid not in state['subtotals']:
+                raise ValueError(f'Unknown participant {pid}')
+            old_holders = _holders(item, order, index)
+            assigned = [p for p in item.get('assignedTo', []) if p != pid]
+            if op == 'assign':
+                assigned.append(pid)
+            item['assignedTo'] = assigned
+            participant = participants[index[pid]]
+            assigned_items = [i for i in participant.get('assignedItems', []) if i != item['id']]
+            if op == 'assign':
+                assigned_items.append(item['id'])
+            participant['assignedItems'] = assigned_items
+            touched |= _move_item(item, old_holders, _holders(item, order, index), state)
+        else:
+            raise ValueError(f'Unsupported change {op!r}')
+
+    charges = {k: delta[k] for k in ('taxAmount', 'taxRate', 'tipAmount', 'tipPercentage') if k in delta}
+    if charges:
+        # A new amount replaces an old percentage and vice versa
+        for amount_key, rate_key in (('taxAmount', 'taxRate'), ('tipAmount', 'tipPercentage')):
+            if amount_key in charges:
+                bill.pop(rate_key, None)
+            if rate_key in charges:
+                bill.pop(amount_key, None)
+        bill.update(charges)
+        _set_charges(bill, state)
+        bill['taxAmount'] = from_cents(state['tax'])
+        bill['tipAmount'] = from_cents(state['tip'])
+
+    changed = touched | _apportion(bill, state)
+    summaries = []
+    for participant in participants:
+        pid = participant['id']
+        if pid not in changed:
+            continue
+        summary = _summary(participant, state['subtotals'][pid], state['taxShares'][pid], state['tipShares'][pid])
+        participant.update(totalOwed=summary['totalOwed'], taxOwed=summary['taxOwed'], tipOwed=summary['tipOwed'])
+        summaries.append(summary)
+    return summaries
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from parse_cache import hash_file
+
+StoredUpload = namedtuple('StoredUpload', ['path', 'sha256', 'size', 'deduplicated'])
+
+_EXTENSION = re.compile(r'^\.[A-Za-z0-9]{1,5}$')
+_HASH_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadStore:
+    # Content-addressed upload storage: files are named by their SHA-256 and
+    # sharded as <root>/ab/cd/<hash><ext>, so identical images are stored
+    # once and no directory grows past a few hundred entries. A background
+    # sweeper removes files older than `ttl` and then the least recently
+    # uploaded ones until the total is under `max_bytes`.
+
+    def __init__(self, root, ttl=30 * 24 * 3600, max_bytes=5 * 1024 ** 3, sweep_interval=600, chunk_size=256 * 1024):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.chunk_size = chunk_size
+        self._tmp_dir = os.path.join(root, 'tmp')
+        self._stats = {'stored': 0, 'deduplicated': 0, 'evicted': 0, 'files': 0, 'bytes': 0}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    def save(self, file):
+        # Copies the upload stream to disk chunk by chunk while hashing it, so
+        # the image is never held in memory in full.
+        ext = os.path.splitext(file.filename or '')[1].lower()
+        if not _EXTENSION.match(ext):
+            ext = ''
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self._tmp_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as out:
+                for chunk in iter(lambda: file.stream.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            path = self.path_for(sha256, ext)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                os.utime(path)  # a re-upload counts as fresh for retention
+                deduplicated = True
+            else:
+                os.replace(tmp_path, path)
+                deduplicated = False
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._stats['deduplicated' if deduplicated else 'stored'] += 1
+        return StoredUpload(path, sha256, size, deduplicated)
+
+    def path_for(self, sha256, ext=''):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256 + ext)
+
+    def content_hash(self, path):
+        # Stored files are named by their hash, so it can be read off the name
+        name = os.path.splitext(os.path.basename(path))[0]
+        if _HASH_NAME.match(name) and os.path.dirname(os.path.abspath(path)).startswith(os.path.abspath(self.root)):
+            return name
+        return hash_file(path)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='upload-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+
+    def _sweep_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except OSError:
+                pass
+            self._stop.wait(self.sweep_interval)
+
+    def sweep(self):
+        now = time.time()
+        entries = []
+        total = 0
+        evicted = 0
+        for root, dirs, files in os.walk(self.root):
+            in_tmp = os.path.abspath(root) == os.path.abspath(self._tmp_dir)
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if in_tmp:
+                    # Leftovers from interrupted uploads
+                    if now - st.st_mtime > 3600:
+                        evicted += self._remove(path)
+                    continue
+                if now - st.st_mtime > self.ttl:
+                    evicted += self._remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        files = len(entries)
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    evicted += 1
+                    files -= 1
+                    total -= size
+        with self._lock:
+            self._stats['evicted'] += evicted
+            self._stats['files'] = files
+            self._stats['bytes'] = total
+        return evicted
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return 0
+        return 1
@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import importlib.util
+import json
+
+from metrics import registry, Counter, Histogram, BYTES_BUCKETS
+
+# msgpack and cbor2 are optional and imported on first use; clients asking
+# for a format whose package is missing get JSON
+_MODULES = {'msgpack': 'msgpack', 'cbor': 'cbor2'}
+_AVAILABLE = {fmt: importlib.util.find_spec(module) is not None for fmt, module in _MODULES.items()}
+
+SYNC_RESPONSES = registry.register(Counter(
+    'tabtogether_sync_responses_total', 'Sync responses, by kind', ['kind']))
+SYNC_BYTES = registry.register(Histogram(
+    'tabtogether_sync_response_bytes', 'Sync response body size on the wire', ['format', 'encoding'], buckets=BYTES_BUCKETS))
+
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'msgpack': 'application/msgpack',
+    'cbor': 'application/cbor',
+}
+_ACCEPTED = {
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/cbor': 'cbor',
+}
+GZIP_MIN_BYTES = 1024
+
+
+def available(fmt):
+    return fmt == 'json' or _AVAILABLE.get(fmt, False)
+
+
+def negotiate(accept, requested=None):
+    # ?format= wins over the Accept header; anything unavailable is JSON
+    if requested:
+        return requested if requested in MEDIA_TYPES and available(requested) else 'json'
+    for media_type, _ in accept:
+        fmt = _ACCEPTED.get(media_type)
+        if fmt and available(fmt):
+            return fmt
+    return 'json'
+
+
+def encode(payload, fmt):
+    if fmt == 'msgpack':
+        import msgpack
+        return msgpack.packb(payload, use_bin_type=True)
+    if fmt == 'cbor':
+        import cbor2
+        return cbor2.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def compress(body, accept_encoding):
+    # Returns (body, content_encoding). Small bodies are sent as they are,
+    # since gzip's header would outweigh the saving.
+    if len(body) < GZIP_MIN_BYTES or 'gzip' not in accept_encoding:
+        return body, None
+    return gzip.compress(body, compresslevel=6), 'gzip'
+
+
+def etag(user_id, since, limit, version, fmt):
+    # Identifies the response to a sync request without building it: the
+    # same cursor and batch size against an unchanged history always give
+    # the same changes
+    key = json.dumps([user_id, since, limit, version, fmt])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
@@ -0,0 +1,39 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPO_ROOT, os.path.join(REPO_ROOT, 'bench')]
+
+
+@pytest.fixture
+def model_server():
+    # bench/fake_model_server.py on a free port, answering immediately;
+    # set `fail_next`, `failure_status` or `failure_rate` on it to script failures
+    from fake_model_server import serve
+
+    server = serve(latency=0, jitter=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    # app.py imported once, with the fake parser and its database and uploads
+    # in a scratch directory
+    workdir = tmp_path_factory.mktemp('app')
+    os.environ.update(
+        PARSER_BACKEND='fake',
+        FAKE_PARSER_LATENCY='0',
+        FAKE_PARSER_JITTER='0',
+        DATABASE_PATH=str(workdir / 'tabtogether.db'),
+    )
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        yield importlib.import_module('app')
+    finally:
+        os.chdir(previous)
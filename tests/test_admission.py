@@ -0,0 +1,102 @@
+import io
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_admits_up_to_max_concurrency_without_waiting():
+    controller = AdmissionController(max_concurrency=2, max_queue=0)
+    controller.acquire('a')
+    controller.acquire('b')
+    assert controller.stats()['active'] == 2
+    controller.release(0.1)
+    controller.release(0.1)
+    assert controller.stats()['active'] == 0
+
+
+def test_full_queue_is_rejected_with_429_and_retry_after():
+    controller = AdmissionController(max_concurrency=1, max_queue=0)
+    controller.acquire()
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire()
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.retry_after >= 1
+    assert controller.stats()['rejected'] == 1
+    with pytest.raises(AdmissionRejected):
+        controller.check()
+
+
+def test_per_client_queue_limit():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, max_queue_per_client=1, max_wait=5)
+    controller.acquire('busy')
+    waiter = threading.Thread(target=lambda: (controller.acquire('greedy'), controller.release(0)))
+    waiter.start()
+    while controller.stats()['queued'] < 1:
+        time.sleep(0.01)
+    with pytest.raises(AdmissionRejected):
+        controller.acquire('greedy')
+    # Other clients still get a place in the queue
+    controller.check('polite')
+    controller.release(0.1)
+    waiter.join(timeout=5)
+    assert controller.stats()['active'] == 0
+
+
+def test_wait_times_out_with_retry_after():
+    controller = AdmissionController(max_concurrency=1, max_queue=4, max_wait=0.1)
+    controller.acquire()
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire()
+    assert excinfo.value.retry_after >= 1
+    assert controller.stats()['queued'] == 0
+
+
+def test_waiters_are_served_round_robin_across_clients():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, max_wait=5)
+    controller.acquire('first')
+    order = []
+    lock = threading.Lock()
+
+    def call(client):
+        controller.acquire(client)
+        with lock:
+            order.append(client)
+        controller.release(0)
+
+    threads = []
+    for client in ['heavy', 'heavy', 'heavy', 'light']:
+        thread = threading.Thread(target=call, args=(client,))
+        thread.start()
+        threads.append(thread)
+        # Queue them in a known order
+        while controller.stats()['queued'] < len(threads):
+            time.sleep(0.01)
+    controller.release(0)
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == ['heavy', 'light', 'heavy', 'heavy']
+
+
+def test_token_budget_limits_admissions():
+    controller = AdmissionController(max_concurrency=10, max_queue=0, tokens_per_minute=3000, tokens_per_call=1500)
+    controller.acquire()
+    controller.acquire()
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire()
+    # Refilling 1500 tokens at 3000 a minute takes about 30 seconds
+    assert excinfo.value.retry_after >= 1
+
+
+def test_upload_is_rejected_with_429_when_model_capacity_is_full(app_module, monkeypatch):
+    controller = AdmissionController(max_concurrency=1, max_queue=0)
+    controller.acquire()
+    monkeypatch.setattr(app_module, 'admission', controller)
+    monkeypatch.setattr(app_module.parse_cache, 'get', lambda key: None)
+    client = app_module.app.test_client()
+    response = client.post('/upload', data={'file': (io.BytesIO(b'not cached ' + bytes(range(256))), 'r.jpg')})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert 'error' in response.get_json()
@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize('body', [[1, 2], 'bill', {'bills': [1, 2]}, {'bills': 'bill'}])
+def test_split_itemized_rejects_malformed_bodies(client, body):
+    response = client.post('/split/itemized', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Invalid bill')
+
+
+def test_split_itemized_splits_bills(client):
+    bill = {'items': [{'id': 'a', 'price': 9.0, 'isSharedEqually': True}], 'participants': [{'id': 'x'}, {'id': 'y'}]}
+    response = client.post('/split/itemized', json={'bills': [bill]})
+    assert response.status_code == 200
+    assert [p['totalOwedCents'] for p in response.get_json()['results'][0]['participants']] == [450, 450]
+
+
+@pytest.mark.parametrize('receipt_id', [['x'], {'id': 'x'}, 7, None])
+def test_split_rejects_non_string_receipt_id(client, receipt_id):
+    response = client.post('/split', json={'people': 2, 'receipt_id': receipt_id})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == '"receipt_id" must be a string'
+
+    response = client.post('/split/itemized', json={'receipt_id': receipt_id})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == '"receipt_id" must be a string'
+
+
+def test_split_unknown_receipt_is_not_found(client):
+    assert client.post('/split', json={'people': 2, 'receipt_id': 'missing'}).status_code == 404
+    assert client.post('/split/itemized', json={'receipt_id': 'missing'}).status_code == 404
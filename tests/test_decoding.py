@@ -0,0 +1,135 @@
+import json
+import math
+
+import pytest
+
+from decoding import DecodeError, decode_items, load_item, normalize_item, parse_price
+from item_stream import ItemStreamDecoder
+
+ITEMS = [{'item': 'Tea', 'price': 4.5}, {'item': 'Cake', 'price': 3.2, 'quantity': 2}]
+ITEMS_JSON = json.dumps(ITEMS)
+
+
+@pytest.mark.parametrize('text,repairs', [
+    (ITEMS_JSON, []),
+    (json.dumps({'items': ITEMS}), []),
+    (f'```json\n{ITEMS_JSON}\n```', ['fence']),
+    (f'```\n{ITEMS_JSON}\n```', ['fence']),
+    (f'Here are the items:\n{ITEMS_JSON}\nLet me know if you need anything else.', ['extracted']),
+    ('[{"item": "Tea", "price": 4.5,}, {"item": "Cake", "price": 3.2, "quantity": 2},]', ['syntax']),
+    ('[{“item”: “Tea”, “price”: 4.5}, {“item”: “Cake”, “price”: 3.2, “quantity”: 2}]', ['syntax']),
+    (json.dumps({'receipt': ITEMS}), ['unwrapped']),
+])
+def test_decode_items_repairs_common_mistakes(text, repairs):
+    items, applied = decode_items(text)
+    assert items == ITEMS
+    assert applied == repairs
+
+
+def test_decode_items_accepts_empty_list():
+    assert decode_items('[]') == ([], [])
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    'I could not read this receipt.',
+    '{"total": 12.5}',
+    '[{"price": 1}, {"item": "", "price": 2}, {"item": "Tea", "price": "free"}, 7]',
+    None,
+])
+def test_decode_items_raises_when_nothing_is_usable(text):
+    with pytest.raises(DecodeError) as excinfo:
+        decode_items(text)
+    assert excinfo.value.status_code == 502
+
+
+def test_decode_items_drops_only_unusable_entries():
+    items, repairs = decode_items('[{"item": "Tea", "price": 1}, {"price": 2}, {"name": "Cake", "price": "$3"}]')
+    assert items == [{'item': 'Tea', 'price': 1.0}, {'item': 'Cake', 'price': 3.0}]
+    assert sorted(repairs) == ['dropped', 'name_key', 'price']
+
+
+@pytest.mark.parametrize('text,expected', [
+    ('$4.50', 4.5),
+    ('4,50 €', 4.5),
+    ('1,234.50', 1234.5),
+    ('1.234,50', 1234.5),
+    ('USD 12', 12.0),
+    ('1,234', 1234.0),
+    ('−2.00', -2.0),
+    ('free', None),
+    ('', None),
+    (None, None),
+])
+def test_parse_price(text, expected):
+    assert parse_price(text) == expected
+
+
+@pytest.mark.parametrize('quantity,expected', [
+    (2, 2),
+    ('2', 2),
+    ('3.0', 3),
+    (float('inf'), 1),
+    (float('nan'), 1),
+    (0, 1),
+    (-4, 1),
+    ('two', 1),
+    (True, 1),
+])
+def test_normalize_item_quantity(quantity, expected):
+    repairs = []
+    item = normalize_item({'item': 'Tea', 'price': 1, 'quantity': quantity}, repairs)
+    assert item.get('quantity', 1) == expected
+    if quantity != expected:
+        assert repairs == ['quantity']
+
+
+def test_decode_items_handles_overflowing_quantity():
+    # 1e999 decodes to inf, which int() cannot convert
+    items, repairs = decode_items('[{"item": "a", "price": 1, "quantity": 1e999}]')
+    assert items == [{'item': 'a', 'price': 1.0}]
+    assert repairs == ['quantity']
+
+
+def test_normalize_item_drops_non_finite_price():
+    repairs = []
+    assert normalize_item({'item': 'Tea', 'price': math.inf}, repairs) is None
+    assert repairs == ['dropped']
+
+
+def feed_by_character(decoder, text):
+    items = []
+    for ch in text:
+        items.extend(decoder.feed(ch))
+    return items
+
+
+def test_stream_decoder_yields_objects_one_character_at_a_time():
+    decoder = ItemStreamDecoder()
+    text = '```json\n[{"item": "Brace } in {name", "price": 1}, {"item": "Quote \\" here", "price": 2}]\n```'
+    assert feed_by_character(decoder, text) == [
+        {'item': 'Brace } in {name', 'price': 1},
+        {'item': 'Quote " here', 'price': 2},
+    ]
+    assert decoder.done
+
+
+def test_stream_decoder_with_load_item_repairs_and_drops():
+    repairs = []
+    decoder = ItemStreamDecoder(loads=lambda text: load_item(text, repairs))
+    text = ('{"items": [{"item": "a", "price": "1",}, {"item": "b" "price": 2}, '
+            '{"item": “c”, "price": 3}, {"name": "d", "price": "$4.00", "quantity": "2"}]}')
+    assert feed_by_character(decoder, text) == [
+        {'item': 'a', 'price': 1.0},
+        {'item': 'c', 'price': 3.0},
+        {'item': 'd', 'price': 4.0, 'quantity': 2},
+    ]
+    assert decoder.done
+    assert sorted(repairs) == ['dropped', 'name_key', 'price', 'price', 'quantity', 'syntax', 'syntax']
+
+
+def test_stream_decoder_not_done_when_cut_off():
+    decoder = ItemStreamDecoder()
+    assert feed_by_character(decoder, '[{"item": "a", "price": 1}, {"item": "b"') == [{'item': 'a', 'price': 1}]
+    assert not decoder.done
+
@@ -0,0 +1,168 @@
+import time
+
+import pytest
+
+from model_client import (
+    CircuitBreaker, CircuitOpenError, ConnectionPool, ModelClient, ModelClientError, PoolExhaustedError,
+)
+
+PAYLOAD = {'model': 'fake', 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+
+def make_client(server, failure_threshold=5, reset_timeout=30.0, max_attempts=3):
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/v1'
+    return ModelClient(
+        base_url,
+        pool=ConnectionPool(base_url, max_size=2, connect_timeout=2, read_timeout=5),
+        breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+        max_attempts=max_attempts,
+        backoff_base=0.01,
+        backoff_max=0.05,
+    )
+
+
+def test_chat_returns_completion(model_server):
+    client = make_client(model_server)
+    response = client.chat(PAYLOAD)
+    assert response['choices'][0]['message']['content'].startswith('[')
+    assert client.stats()['retries'] == 0
+
+
+def test_chat_stream_yields_content(model_server):
+    client = make_client(model_server)
+    content = ''.join(client.chat_stream(PAYLOAD))
+    assert content == client.chat(PAYLOAD)['choices'][0]['message']['content']
+
+
+def test_retryable_error_is_retried(model_server):
+    model_server.fail_next = 2
+    model_server.failure_status = 503
+    client = make_client(model_server)
+    client.chat(PAYLOAD)
+    assert model_server.requests == 3
+    assert client.stats()['retries'] == 2
+    assert client.breaker.stats()['state'] == CircuitBreaker.CLOSED
+
+
+def test_retries_give_up_after_max_attempts(model_server):
+    model_server.fail_next = 10
+    model_server.failure_status = 500
+    client = make_client(model_server, max_attempts=3)
+    with pytest.raises(ModelClientError) as excinfo:
+        client.chat(PAYLOAD)
+    assert excinfo.value.status == 500
+    assert model_server.requests == 3
+
+
+def test_rate_limit_carries_retry_after(model_server):
+    model_server.fail_next = 10
+    model_server.failure_status = 429
+    client = make_client(model_server, max_attempts=2)
+    started = time.monotonic()
+    with pytest.raises(ModelClientError) as excinfo:
+        client.chat(PAYLOAD)
+    assert excinfo.value.retry_after == 1.0
+    # Retry-After is honoured but capped at backoff_max
+    assert time.monotonic() - started < 1.0
+
+
+def test_client_error_is_not_retried_and_does_not_trip_breaker(model_server):
+    model_server.fail_next = 10
+    model_server.failure_status = 400
+    client = make_client(model_server, failure_threshold=1)
+    with pytest.raises(ModelClientError) as excinfo:
+        client.chat(PAYLOAD)
+    assert not excinfo.value.retryable
+    assert model_server.requests == 1
+    assert client.breaker.stats()['state'] == CircuitBreaker.CLOSED
+
+
+def test_breaker_opens_and_rejects_without_calling_provider(model_server):
+    model_server.fail_next = 2
+    model_server.failure_status = 500
+    client = make_client(model_server, failure_threshold=2, max_attempts=1)
+    for _ in range(2):
+        with pytest.raises(ModelClientError):
+            client.chat(PAYLOAD)
+    assert client.breaker.stats() == {'state': CircuitBreaker.OPEN, 'consecutive_failures': 2, 'opens': 1}
+    with pytest.raises(CircuitOpenError) as excinfo:
+        client.chat(PAYLOAD)
+    assert excinfo.value.retry_after > 0
+    assert model_server.requests == 2
+
+
+def test_half_open_trial_reopens_on_failure_and_closes_on_success(model_server):
+    model_server.failure_status = 500
+    model_server.fail_next = 1
+    client = make_client(model_server, failure_threshold=1, reset_timeout=0.2, max_attempts=1)
+    with pytest.raises(ModelClientError):
+        client.chat(PAYLOAD)
+    assert client.breaker.stats()['state'] == CircuitBreaker.OPEN
+
+    # The trial call fails, so the circuit opens again straight away
+    time.sleep(0.25)
+    model_server.fail_next = 1
+    with pytest.raises(ModelClientError):
+        client.chat(PAYLOAD)
+    assert client.breaker.stats()['state'] == CircuitBreaker.OPEN
+    assert client.breaker.stats()['opens'] == 2
+    with pytest.raises(CircuitOpenError):
+        client.chat(PAYLOAD)
+
+    # A successful trial closes it
+    time.sleep(0.25)
+    client.chat(PAYLOAD)
+    assert client.breaker.stats() == {'state': CircuitBreaker.CLOSED, 'consecutive_failures': 0, 'opens': 2}
+    assert model_server.requests == 3
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+
+
+def test_connection_failure_is_retryable():
+    # Nothing listens on the port the OS just handed out and closed
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    base_url = f'http://127.0.0.1:{port}/v1'
+    client = ModelClient(base_url, pool=ConnectionPool(base_url, connect_timeout=1), max_attempts=2,
+                         backoff_base=0.01, backoff_max=0.05)
+    with pytest.raises(ModelClientError) as excinfo:
+        client.chat(PAYLOAD)
+    assert excinfo.value.retryable
+    assert client.stats()['retries'] == 1
+
+
+def test_pool_exhaustion_is_not_a_provider_failure(model_server):
+    base_url = f'http://127.0.0.1:{model_server.server_address[1]}/v1'
+    pool = ConnectionPool(base_url, max_size=1, connect_timeout=2, read_timeout=0.1)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    client = ModelClient(base_url, pool=pool, breaker=breaker, max_attempts=3, backoff_base=0.01)
+    held = pool.acquire()
+    try:
+        with pytest.raises(PoolExhaustedError) as excinfo:
+            client.chat(PAYLOAD)
+        assert excinfo.value.status_code == 503
+        assert breaker.stats() == {'state': CircuitBreaker.CLOSED, 'consecutive_failures': 0, 'opens': 0}
+        assert client.stats()['retries'] == 0
+        assert model_server.requests == 0
+
+        # A half-open trial that cannot get a connection frees the trial slot
+        breaker.record_failure()
+        time.sleep(0.06)
+        with pytest.raises(PoolExhaustedError):
+            client.chat(PAYLOAD)
+    finally:
+        pool.release(held)
+    client.chat(PAYLOAD)
+    assert breaker.stats()['state'] == CircuitBreaker.CLOSED
@@ -0,0 +1,173 @@
+import copy
+import random
+
+import pytest
+
+import split_engine
+from split_engine import allocate, apply_split_delta, build_split_state, split_bill
+
+
+def random_bill(rng, participants=4, items=12):
+    people = [{'id': f'p{i}', 'name': f'Person {i}'} for i in range(participants)]
+    bill_items = []
+    for i in range(items):
+        shared = rng.random() < 0.2
+        bill_items.append({
+            'id': f'i{i}',
+            'name': f'Item {i}',
+            'price': round(rng.uniform(0.01, 60), 2),
+            'quantity': rng.choice([1, 1, 2, 3]),
+            'isSharedEqually': shared,
+            'assignedTo': [] if shared else rng.sample([p['id'] for p in people], rng.randint(0, participants)),
+        })
+    bill = {'id': 'bill', 'items': bill_items, 'participants': people}
+    if rng.random() < 0.5:
+        bill['taxRate'] = rng.choice([0, 7.25, 8.875, 10])
+    else:
+        bill['taxAmount'] = round(rng.uniform(0, 20), 2)
+    if rng.random() < 0.5:
+        bill['tipPercentage'] = rng.choice([0, 15, 18, 22.5])
+    else:
+        bill['tipAmount'] = round(rng.uniform(0, 30), 2)
+    return bill
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def engine(request, monkeypatch):
+    # Runs a test once with the NumPy item shares and once with the pure-Python ones
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+        split_engine.numpy_module()
+    else:
+        monkeypatch.setattr(split_engine, '_numpy', False)
+    return request.param
+
+
+@pytest.mark.parametrize('total,weights', [
+    (100, [1, 1, 1]),
+    (1, [1, 1]),
+    (999, [0, 0, 0]),
+    (0, [3, 5]),
+    (12345, [7, 0, 13, 1]),
+    (5, []),
+])
+def test_allocate_sums_to_total(total, weights):
+    parts = allocate(total, weights)
+    assert len(parts) == len(weights)
+    if weights:
+        assert sum(parts) == total
+
+
+def test_allocate_gives_leftover_cents_by_largest_remainder():
+    assert allocate(100, [1, 1, 1]) == [34, 33, 33]
+    assert allocate(10, [1, 2]) == [3, 7]
+    assert allocate(2, [1, 1, 1]) == [1, 1, 0]
+
+
+def test_allocate_random_weights_sum_to_total():
+    rng = random.Random(1)
+    for _ in range(500):
+        weights = [rng.randint(0, 10_000) for _ in range(rng.randint(1, 12))]
+        total = rng.randint(0, 1_000_000)
+        parts = allocate(total, weights)
+        assert sum(parts) == total
+        assert all(part >= 0 for part in parts)
+
+
+def test_split_bill_parts_add_up_to_total(engine):
+    rng = random.Random(2)
+    for _ in range(200):
+        result = split_bill(random_bill(rng, participants=rng.randint(1, 8), items=rng.randint(0, 20)))
+        verification = result['totalVerification']
+        assert verification['isAccurate']
+        assert verification['calculatedTotal'] == verification['originalTotal']
+        owed = sum(p['totalOwedCents'] for p in result['participants'])
+        assert owed + round(result['unassignedTotal'] * 100) == round(verification['originalTotal'] * 100)
+
+
+def test_split_bill_splits_shared_item_remainder_in_participant_order(engine):
+    bill = {
+        'items': [{'id': 'a', 'price': 10.00, 'isSharedEqually': True}],
+        'participants': [{'id': 'x'}, {'id': 'y'}, {'id': 'z'}],
+    }
+    assert [p['totalOwedCents'] for p in split_bill(bill)['participants']] == [334, 333, 333]
+
+
+def test_split_bill_requires_participants():
+    with pytest.raises(ValueError):
+        split_bill({'items': [], 'participants': []})
+
+
+def test_numpy_and_python_item_shares_agree():
+    pytest.importorskip('numpy')
+    split_engine.numpy_module()
+    rng = random.Random(3)
+    for _ in range(200):
+        participants = rng.randint(1, 10)
+        count = rng.randint(1, 30)
+        holders = [sorted(rng.sample(range(participants), rng.randint(0, participants))) for _ in range(count)]
+        cents = [rng.randint(0, 100_000) for _ in range(count)]
+        assert (split_engine._item_shares_numpy(holders, cents, participants)
+                == split_engine._item_shares_python(holders, cents, participants))
+
+
+def random_change(rng, bill, next_participant):
+    items = bill['items']
+    participant_ids = [p['id'] for p in bill['participants']]
+    roll = rng.random()
+    if roll < 0.1:
+        return {'op': 'addParticipant', 'participant': {'id': f'p{next_participant}', 'name': 'New'}}
+    item = rng.choice(items)
+    return {'op': rng.choice(['assign', 'unassign']), 'itemId': item['id'], 'participantId': rng.choice(participant_ids)}
+
+
+def test_apply_split_delta_matches_full_split(engine):
+    rng = random.Random(4)
+    for _ in range(50):
+        bill = random_bill(rng, participants=rng.randint(1, 6), items=rng.randint(1, 15))
+        state = build_split_state(bill)
+        next_participant = len(bill['participants'])
+        for _ in range(20):
+            delta = {'changes': []}
+            for _ in range(rng.randint(1, 3)):
+                change = random_change(rng, bill, next_participant)
+                if change['op'] == 'addParticipant':
+                    next_participant += 1
+                delta['changes'].append(change)
+            if rng.random() < 0.2:
+                delta[rng.choice(['taxAmount', 'taxRate', 'tipAmount', 'tipPercentage'])] = rng.choice([0, 5, 12.5])
+            apply_split_delta(bill, state, delta)
+
+            full = split_bill(copy.deepcopy(bill))
+            for summary in full['participants']:
+                pid = summary['id']
+                incremental = state['subtotals'][pid] + state['taxShares'][pid] + state['tipShares'][pid]
+                assert incremental == summary['totalOwedCents']
+            unassigned = state['unassigned'] + state['taxShares']['_unassigned'] + state['tipShares']['_unassigned']
+            assert unassigned == round(full['unassignedTotal'] * 100)
+
+
+def test_apply_split_delta_returns_only_changed_participants(engine):
+    bill = {
+        'items': [{'id': 'a', 'price': 10.00, 'assignedTo': []}, {'id': 'b', 'price': 4.00, 'assignedTo': ['y']}],
+        'participants': [{'id': 'x'}, {'id': 'y'}, {'id': 'z'}],
+    }
+    state = build_split_state(bill)
+    changed = apply_split_delta(bill, state, {'changes': [{'op': 'assign', 'itemId': 'a', 'participantId': 'x'}]})
+    assert [summary['id'] for summary in changed] == ['x']
+    assert changed[0]['totalOwedCents'] == 1000
+
+
+def test_apply_split_delta_rejects_unknown_ids():
+    bill = {'items': [{'id': 'a', 'price': 1.0}], 'participants': [{'id': 'x'}]}
+    state = build_split_state(bill)
+    with pytest.raises(ValueError):
+        apply_split_delta(bill, state, {'changes': [{'op': 'assign', 'itemId': 'nope', 'participantId': 'x'}]})
+    with pytest.raises(ValueError):
+        apply_split_delta(bill, state, {'changes': [{'op': 'assign', 'itemId': 'a', 'participantId': 'nope'}]})
+
+
+@pytest.mark.parametrize('bills', [[1, 2], ['bill'], 'bills', {'items': []}])
+def test_split_bills_rejects_non_object_bills(bills):
+    with pytest.raises(ValueError):
+        split_engine.split_bills(bills)
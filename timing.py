@@ -0,0 +1,28 @@
+import time
+from contextlib import contextmanager
+
+from metrics import STAGE_SECONDS
+
+
+class Stages:
+    # Collects per-stage wall time for one request so it can be reported
+    # back in a Server-Timing header; every stage is also recorded in the
+    # tabtogether_stage_seconds histogram.
+
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def time(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+    def server_timing(self):
+        return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.durations.items())